@@ -0,0 +1,96 @@
+"""In-memory stand-ins for the websocket and the session bus."""
+
+import asyncio
+
+from dbus_next import Message
+from dbus_next.service import ServiceInterface
+
+from hassbridge.buspool import BusPool
+
+
+class FakeWebsocket:
+    """Websocket accepting everything sent to it."""
+
+    def __init__(self):
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+    async def send(self, data):
+        """Count the sent frame."""
+        self.frames_sent += 1
+        self.bytes_sent += len(data)
+
+
+class FakeBus:
+    """Message bus marshalling the signals in memory instead of sending them."""
+
+    def __init__(self, stats, latency=0):
+        self._stats = stats
+        self._latency = latency
+        self._exports = {}
+        self._serial = 0
+        self.connected = True
+
+    def export(self, path, interface):
+        """Export the interface, routing its signals to this bus."""
+        self._exports.setdefault(path, []).append(interface)
+        ServiceInterface._add_bus(interface, self)
+
+    def unexport(self, path, interface=None):
+        """Unexport the interfaces on the given path."""
+        for exported in self._exports.pop(path, []):
+            ServiceInterface._remove_bus(exported, self)
+
+    async def request_name(self, name):
+        """Request the name, taking the configured latency."""
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        self._stats.names += 1
+
+    async def release_name(self, name):
+        """Release the name."""
+        self._stats.names -= 1
+
+    def disconnect(self):
+        """Mark the bus disconnected."""
+        self.connected = False
+
+    def _interface_signal_notify(
+        self, interface, interface_name, member, signature, body, unix_fds=()
+    ):
+        path = next(p for p, ifaces in self._exports.items() if interface in ifaces)
+        msg = Message.new_signal(
+            path=path,
+            interface=interface_name,
+            member=member,
+            signature=signature,
+            body=body,
+        )
+        self._serial += 1
+        msg.serial = self._serial
+        self._stats.signals += 1
+        self._stats.signal_bytes += len(msg._marshall())
+
+
+class BusStats:
+    """Counters shared by the fake buses."""
+
+    def __init__(self):
+        self.names = 0
+        self.signals = 0
+        self.signal_bytes = 0
+
+
+def fake_bus_pool(latency=0):
+    """Return a bus pool handing out fake buses, and the stats collected by them.
+
+    `latency` is the time in seconds taken by connecting and requesting names.
+    """
+    stats = BusStats()
+
+    async def factory():
+        if latency:
+            await asyncio.sleep(latency)
+        return FakeBus(stats, latency)
+
+    return BusPool(bus_factory=factory), stats
@@ -0,0 +1,174 @@
+"""Micro-benchmarks for the hot paths of the bridge.
+
+    python benchmarks/micro.py
+
+* codecs: frames/sec decoded by each installed JSON backend, with and without
+  the pre-parse triage dropping frames not concerning media players
+* metadata: repeated Metadata reads, with and without cached album art,
+  and updates keeping or changing the track
+* tracing: update_player with tracing disabled, verifying that no payload
+  gets pretty-printed at INFO level
+* memory: memory retained per bridged player after a number of updates
+"""
+
+import asyncio
+import json
+import logging
+import tempfile
+import timeit
+import tracemalloc
+
+from fakes import FakeWebsocket, fake_bus_pool
+from synthetic import Install
+
+from hassbridge import tracing
+from hassbridge.artcache import ArtCache
+from hassbridge.codec import available_codecs, get_codec
+from hassbridge.hassinterface import HassInterface, _is_relevant_frame
+from hassbridge.playerinterface import PlayerInterface
+
+
+def bench(func, number, items=1):
+    """Return calls (or items processed) per second for the given function."""
+    elapsed = min(timeit.repeat(func, number=number, repeat=3))
+    return round(number * items / elapsed)
+
+
+def bench_codecs(frames):
+    """Measure decoding the frames with each codec, with and without triage."""
+    print("codecs (frames/sec)")
+    for name in available_codecs():
+        loads = get_codec(name).loads
+
+        def decode_all(loads=loads):
+            for frame in frames:
+                loads(frame)
+
+        def triage_and_decode(loads=loads):
+            for frame in frames:
+                if _is_relevant_frame(frame):
+                    loads(frame)
+
+        full = bench(decode_all, 1, len(frames))
+        triaged = bench(triage_and_decode, 1, len(frames))
+        print(f"  {name:<8} decode all {full:>10}  with triage {triaged:>10}")
+
+
+def _player_state(install):
+    entity_id = install.players[0]
+    return dict(install._states[entity_id])
+
+
+def bench_metadata(install):
+    """Measure reading the Metadata and updating a player."""
+    print("metadata (calls/sec)")
+    hass = HassInterface("http://localhost:8123", "token")
+    player = PlayerInterface(
+        "org.mpris.MediaPlayer2.Player", hass, _player_state(install)
+    )
+
+    print(f"  reads                      {bench(lambda: player.Metadata, 100000):>10}")
+
+    def update():
+        state = _player_state(install)
+        state["attributes"] = {**state["attributes"], "volume_level": 0.1}
+        player.update_data(state)
+
+    print(f"  updates (same track)       {bench(update, 10000):>10}")
+
+    tracks = iter(range(10**9))
+
+    def change_track():
+        state = _player_state(install)
+        title = f"Track {next(tracks)}"
+        state["attributes"] = {**state["attributes"], "media_title": title}
+        player.update_data(state)
+
+    print(f"  updates (track changes)    {bench(change_track, 10000):>10}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        art_cache = ArtCache(directory)
+        state = _player_state(install)
+        url = f"{hass.http_endpoint}{state['attributes']['entity_picture']}"
+        art_cache._add(art_cache.key(url), 0)
+        hass = HassInterface("http://localhost:8123", "token", art_cache=art_cache)
+        player = PlayerInterface("org.mpris.MediaPlayer2.Player", hass, state)
+
+        if not player.Metadata["mpris:artUrl"].value.startswith("file:"):
+            raise SystemExit("the album art is not served from the cache")
+        reads = bench(lambda: player.Metadata, 100000)
+        print(f"  reads (cached art)         {reads:>10}")
+
+
+def bench_tracing(install):
+    """Check that the tracing payloads are not formatted with tracing disabled."""
+    print("tracing (update_player calls/sec at INFO)")
+    formatted = 0
+    original = tracing.pformat
+
+    def counting_pformat(obj):
+        nonlocal formatted
+        formatted += 1
+        return original(obj)
+
+    tracing.pformat = counting_pformat
+
+    async def run():
+        bus_pool, _ = fake_bus_pool()
+        hass = HassInterface("http://localhost:8123", "token", bus_pool=bus_pool)
+        hass.ws = FakeWebsocket()
+        entity_id = install.players[0]
+        await hass.update_player(entity_id, _player_state(install))
+        await hass.wait_for_players()
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for _ in range(10000):
+            await hass.update_player(entity_id, _player_state(install))
+        return round(10000 / (loop.time() - start))
+
+    tracing.configure_tracing([])
+    disabled = asyncio.run(run())
+    print(f"  tracing disabled           {disabled:>10}  pformat calls: {formatted}")
+    tracing.pformat = original
+    if formatted:
+        raise SystemExit("payloads got formatted with tracing disabled")
+
+
+def bench_player_memory(install, updates=10):
+    """Measure the memory retained per player after the given number of updates."""
+    print("memory (bytes per player)")
+    states = [
+        json.dumps(install._next_state(entity_id)[1])
+        for _ in range(updates)
+        for entity_id in install.players
+    ]
+
+    async def run():
+        bus_pool, _ = fake_bus_pool()
+        hass = HassInterface("http://localhost:8123", "token", bus_pool=bus_pool)
+        hass.ws = FakeWebsocket()
+
+        tracemalloc.start()
+        for state in states:
+            state = json.loads(state)
+            await hass.update_player(state["entity_id"], state)
+            await hass.wait_for_players()
+        del state
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return round(retained / len(hass._players))
+
+    print(f"  retained                   {asyncio.run(run()):>10}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("hassbridge").setLevel(logging.WARNING)
+
+    install = Install(1000)
+    bench_codecs(install.event_frames(5000))
+    bench_metadata(install)
+    bench_tracing(install)
+    bench_player_memory(install)
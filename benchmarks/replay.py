@@ -0,0 +1,360 @@
+"""Replay homeassistant websocket traffic through the bridge.
+
+Drives HassInterface.handle_message with synthetic installs of different sizes,
+or with frames recorded using `hassbridge --record`, using in-memory stand-ins
+for the websocket and the session bus, so no homeassistant or D-Bus is needed.
+
+    python benchmarks/replay.py
+    python benchmarks/replay.py --sizes 10,1000 --events 5000
+    python benchmarks/replay.py --replay recording.jsonl
+    python benchmarks/replay.py --queued
+    python benchmarks/replay.py --bus-latency 5
+    python benchmarks/replay.py --coalesce 10
+    python benchmarks/replay.py --compare benchmarks/baseline.json
+    python benchmarks/replay.py --save-baseline benchmarks/baseline.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import sys
+import time
+import tracemalloc
+import zlib
+from unittest import mock
+
+from fakes import FakeWebsocket, fake_bus_pool
+from synthetic import EPOCH, EVENT_INTERVAL, Install
+
+from hassbridge.hassinterface import HassInterface
+
+# metrics compared against the baseline, and whether larger values are better;
+# these do not depend on the speed of the machine, so regressions fail the run
+COMPARED = {
+    "frames_discarded": True,
+    "signals": False,
+    "peak_memory_kb": False,
+}
+# the synthetic traffic is seeded, so these are reproduced exactly
+EXACT = {"frames_discarded", "signals"}
+# timings depend on the machine running the benchmark, so they are only reported
+REPORTED = {
+    "events_per_sec": True,
+    "latency_p99_us": False,
+}
+
+
+def percentile(values, percent):
+    """Return the given percentile of the sorted values."""
+    if not values:
+        return 0
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+    return values[index]
+
+
+def coalesce(frames, size):
+    """Join every `size` frames into one, like homeassistant coalescing messages."""
+    if size <= 1:
+        return frames
+    return [
+        "[" + ",".join(frames[i : i + size]) + "]" for i in range(0, len(frames), size)
+    ]
+
+
+def wire_bytes(frames, window_bits=15):
+    """Return the size of the frames without and with permessage-deflate.
+
+    The frames are compressed with the context carried over between them,
+    as done by default by homeassistant and websockets.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -window_bits, 5)
+    raw = deflated = 0
+    for frame in frames:
+        data = frame.encode()
+        raw += len(data)
+        # the empty block ending each message is not sent
+        deflated += (
+            len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+        )
+    return raw, deflated
+
+
+async def _bridge(subscription="events", codec=None, bus_latency=0):
+    bus_pool, bus_stats = fake_bus_pool(bus_latency)
+    hass = HassInterface(
+        "http://localhost:8123",
+        "token",
+        subscription=subscription,
+        bus_pool=bus_pool,
+        codec=codec,
+    )
+    hass.ws = FakeWebsocket()
+    if subscription == "entities":
+        await hass.subscribe_entities()
+    else:
+        await hass.subscribe()
+        await hass.find_players()
+
+    return hass, bus_stats
+
+
+async def _drain(hass):
+    """Wait for the worker to process the queued updates."""
+    while hass.queue_depth:
+        await asyncio.sleep(0)
+    # let the worker finish the last one
+    await asyncio.sleep(0)
+
+
+class SyntheticClock:
+    """Stand-in for `time.time`, advanced by the replay for each frame."""
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        """Return the synthetic time."""
+        return self.now
+
+
+async def run(
+    initial,
+    frames,
+    events=None,
+    subscription="events",
+    codec=None,
+    queued=False,
+    bus_latency=0,
+    measure=True,
+    frame_interval=None,
+):
+    """Feed the frames through a fresh bridge and return the results.
+
+    `events` is the number of events in the frames, if coalesced (see `coalesce`),
+    the latencies are then per frame.
+    With `queued`, the frames are handed to the worker like in the receive loop,
+    and the latencies are those of reading the frames.
+    `bus_latency` is the time in seconds taken by each D-Bus call
+    when creating players, startup includes waiting for them to be created.
+    With `frame_interval`, the bridge sees the synthetic time instead of
+    the wall clock, advancing by the interval for each frame, so the signals
+    depending on the extrapolated positions are reproducible.
+    """
+    clock = None
+    patched_time = contextlib.nullcontext()
+    if frame_interval is not None:
+        clock = SyntheticClock(EPOCH.timestamp())
+        patched_time = mock.patch("time.time", clock)
+
+    with patched_time:
+        hass, bus_stats = await _bridge(subscription, codec, bus_latency)
+        if queued:
+            hass.start_worker()
+
+        start = time.perf_counter()
+        for frame in initial:
+            await hass.handle_message(frame)
+        if queued:
+            await _drain(hass)
+        await hass.wait_for_players()
+        startup = time.perf_counter() - start
+
+        if events is None:
+            events = len(frames)
+        latencies = []
+        handle_message = hass.handle_message
+        perf_counter_ns = time.perf_counter_ns
+        start = time.perf_counter()
+        for frame in frames:
+            if clock is not None:
+                clock.now += frame_interval
+            before = perf_counter_ns()
+            await handle_message(frame)
+            if measure:
+                latencies.append(perf_counter_ns() - before)
+        if queued:
+            await _drain(hass)
+            hass.stop_worker()
+        await hass.wait_for_players()
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+
+        return {
+            "events": events,
+            "frames": len(frames),
+            "players": len(hass._players),
+            "startup_ms": round(startup * 1000, 2),
+            "events_per_sec": round(events / elapsed) if elapsed else 0,
+            "latency_p50_us": round(percentile(latencies, 50) / 1000, 1),
+            "latency_p90_us": round(percentile(latencies, 90) / 1000, 1),
+            "latency_p99_us": round(percentile(latencies, 99) / 1000, 1),
+            "frames_discarded": hass.frames_discarded,
+            "messages_decoded": hass.messages_decoded,
+            "updates_merged": hass.updates_merged,
+            "signals": bus_stats.signals,
+            "signal_bytes": bus_stats.signal_bytes,
+        }
+
+
+async def run_with_memory(initial, frames, **kwargs):
+    """Run the frames twice, once for timings and once for the peak memory."""
+    results = await run(initial, frames, **kwargs)
+
+    tracemalloc.start()
+    await run(initial, frames, measure=False, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results["peak_memory_kb"] = round(peak / 1024)
+
+    raw, deflated = wire_bytes(frames)
+    results["wire_kb"] = round(raw / 1024)
+    results["deflated_kb"] = round(deflated / 1024)
+
+    return results
+
+
+def load_recording(path):
+    """Return the initial and event frames from a recording.
+
+    Auth frames are skipped, and the frames up to the first event
+    (i.e., the subscription and initial state results) are the initial ones.
+    """
+    initial, events = [], []
+    with open(path) as f:
+        for line in f:
+            frame = json.loads(line)["frame"]
+            if '"type":"auth' in frame[:40]:
+                continue
+            if not events and '"type":"event"' not in frame[:40]:
+                initial.append(frame)
+            else:
+                events.append(frame)
+
+    return initial, events
+
+
+def compare(results, baseline, tolerance, metrics=COMPARED):
+    """Return a list of regressions of the given metrics compared to the baseline."""
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        for metric, larger_is_better in metrics.items():
+            if metric not in expected or metric not in result:
+                continue
+            old, new = expected[metric], result[metric]
+            allowed = 0 if metric in EXACT else tolerance
+            if larger_is_better:
+                regressed = new < old * (1 - allowed)
+            else:
+                regressed = new > old * (1 + allowed)
+            if regressed:
+                regressions.append(f"{name}: {metric} {old} -> {new}")
+
+    return regressions
+
+
+async def main(args):
+    """Run the benchmark, returning the exit status."""
+    results = {}
+    if args.replay:
+        initial, events = load_recording(args.replay)
+        results[args.replay] = await run_with_memory(
+            initial,
+            coalesce(events, args.coalesce),
+            events=len(events),
+            subscription=args.subscription,
+            codec=args.codec,
+            queued=args.queued,
+            bus_latency=args.bus_latency / 1000,
+        )
+    else:
+        for size in args.sizes:
+            install = Install(size)
+            if args.subscription == "entities":
+                initial = [install.entities_frame()]
+                events = install.entities_frames(args.events)
+            else:
+                initial = [install.get_states_frame()]
+                events = install.event_frames(args.events)
+            results[f"{size}_entities"] = await run_with_memory(
+                initial,
+                coalesce(events, args.coalesce),
+                events=len(events),
+                subscription=args.subscription,
+                codec=args.codec,
+                queued=args.queued,
+                bus_latency=args.bus_latency / 1000,
+                frame_interval=EVENT_INTERVAL * args.coalesce,
+            )
+
+    for name, result in results.items():
+        print(name)
+        for key, value in result.items():
+            print(f"  {key:<16} {value}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        for slower in compare(results, baseline, args.tolerance, REPORTED):
+            print(f"SLOWER {slower} (not failing, timings depend on the machine)")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=lambda s: [int(x) for x in s.split(",")],
+        default=[10, 1000, 50000],
+        help="comma-separated numbers of entities to simulate",
+    )
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--replay", help="replay a recording instead")
+    parser.add_argument(
+        "--subscription", choices=["events", "entities"], default="events"
+    )
+    parser.add_argument("--codec", default=None)
+    parser.add_argument(
+        "--queued",
+        action="store_true",
+        help="process the frames in the worker, like the receive loop does",
+    )
+    parser.add_argument(
+        "--bus-latency",
+        type=float,
+        default=0,
+        help="milliseconds taken by each D-Bus call when creating players",
+    )
+    parser.add_argument(
+        "--coalesce",
+        type=int,
+        default=1,
+        help="events per frame, like homeassistant coalescing messages",
+    )
+    parser.add_argument("--compare", help="baseline to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.5,
+        help="allowed relative regression of the memory and timings",
+    )
+    parser.add_argument("--save-baseline", help="write the results to a file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,170 @@
+"""Cold-start budget of the hassbridge cli.
+
+Checks that importing the cli does not pull in the subsystems (websockets,
+D-Bus, the homeassistant interface), and that `hassbridge --help` starts
+within the given budget, exiting with an error otherwise.
+With `--phases`, the bridge is started against the simulator using in-memory
+buses, reporting the time taken by each startup phase.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --budget 300 --runs 10
+    python benchmarks/startup.py --phases --players 100
+"""
+
+import argparse
+import asyncio
+import logging
+import socket
+import statistics
+import subprocess  # noqa: S404
+import sys
+import time
+
+# modules which must not be imported by `import hassbridge.cli`
+LAZY_MODULES = (
+    "websockets",
+    "dbus_next",
+    "hassbridge.hassinterface",
+    "hassbridge.playerinterface",
+    "hassbridge.mprismain",
+)
+
+CHECK_IMPORTS = f"""
+import sys
+import hassbridge.cli
+print(" ".join(m for m in {LAZY_MODULES!r} if m in sys.modules))
+"""
+
+
+def check_imports() -> bool:
+    """Return True if importing the cli leaves the subsystems unimported."""
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", CHECK_IMPORTS],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    imported = result.stdout.split()
+    if imported:
+        print(f"import hassbridge.cli imports: {', '.join(imported)}")
+        return False
+
+    print("import hassbridge.cli imports none of the subsystems")
+    return True
+
+
+def time_command(args, runs) -> float:
+    """Return the median wall time in ms of running python with the given args."""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(  # noqa: S603
+            [sys.executable, *args], check=True, stdout=subprocess.DEVNULL
+        )
+        timings.append((time.perf_counter() - started) * 1000)
+
+    return statistics.median(timings)
+
+
+def time_help(runs) -> float:
+    """Return the median wall time in ms of `hassbridge --help` in a new process."""
+    return time_command(["-m", "hassbridge.cli", "--help"], runs)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def measure_phases(players, subscription):
+    """Start the bridge against the simulator and return the startup timer."""
+    from hassbridge.simulator import Simulator
+    from hassbridge.stats import StartupTimer
+
+    port = _free_port()
+    simulator = Simulator(players=players, entities=1000, rate=0, seed=0)
+    server = asyncio.ensure_future(simulator.serve("127.0.0.1", port))
+    # give the simulator a moment to start listening
+    await asyncio.sleep(0.1)
+
+    # the simulator has already imported websockets,
+    # so the import phase covers the rest of the bridge
+    timer = StartupTimer()
+    from fakes import fake_bus_pool
+
+    from hassbridge.hassinterface import HassInterface
+
+    timer.mark("import")
+    bus_pool, _ = fake_bus_pool()
+    hass = HassInterface(
+        f"http://127.0.0.1:{port}",
+        "token",
+        subscription=subscription,
+        bus_pool=bus_pool,
+        startup_timer=timer,
+    )
+    bridge = asyncio.ensure_future(hass.start())
+    try:
+        while not timer.done:
+            await asyncio.sleep(0.01)
+    finally:
+        for task in (bridge, server):
+            task.cancel()
+        await asyncio.gather(bridge, server, return_exceptions=True)
+
+    return timer
+
+
+def main():
+    """Check the cold start, exiting with an error if over the budget."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=500,
+        help="Maximum median time in ms for `hassbridge --help` (default: 500)",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=5, help="Number of timed runs (default: 5)"
+    )
+    parser.add_argument(
+        "--phases",
+        action="store_true",
+        help="Report the startup phases against the simulator",
+    )
+    parser.add_argument(
+        "--players",
+        type=int,
+        default=20,
+        help="Number of simulated players for --phases (default: 20)",
+    )
+    parser.add_argument(
+        "--subscription", choices=("events", "entities"), default="events"
+    )
+    args = parser.parse_args()
+
+    ok = check_imports()
+
+    median = time_help(args.runs)
+    within = median <= args.budget
+    print(
+        f"hassbridge --help: {median:.1f} ms (median of {args.runs}),"
+        f" budget {args.budget:.0f} ms{'' if within else ' EXCEEDED'}"
+    )
+    ok = ok and within
+
+    if args.phases:
+        logging.basicConfig(level=logging.WARNING)
+        timer = asyncio.run(measure_phases(args.players, args.subscription))
+        print(f"startup phases ({args.players} players, {args.subscription})")
+        for phase, duration in timer.durations.items():
+            print(f"  {phase:<14} {duration * 1000:>8.1f} ms")
+        print(f"  {'total':<14} {timer.total * 1000:>8.1f} ms")
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""Synthetic homeassistant websocket traffic.
+
+The frames are serialized compactly, like homeassistant does.
+Request ids match the requests made by a freshly started bridge:
+1 for the subscription and 2 for get_states.
+Both state_changed events and the compressed subscribe_entities
+format are supported.
+"""
+
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+SUBSCRIPTION_ID = 1
+GET_STATES_ID = 2
+
+# share of media players among all entities, and among the events
+PLAYER_RATIO = 0.01
+PLAYER_EVENT_RATIO = 0.05
+
+# the synthetic time starts from a fixed point, so the frames are reproducible;
+# replay them with `time.time` following the synthetic time, as positions
+# are extrapolated from it (see replay.SyntheticClock)
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+# synthetic time in seconds between the events
+EVENT_INTERVAL = 0.05
+
+
+def dumps(obj) -> str:
+    """Serialize the object compactly."""
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def _timestamp(seconds) -> str:
+    return (EPOCH + timedelta(seconds=seconds)).isoformat()
+
+
+def _unix_time(seconds) -> float:
+    return (EPOCH + timedelta(seconds=seconds)).timestamp()
+
+
+def _context(rnd):
+    return {"id": f"{rnd.getrandbits(128):032x}", "parent_id": None, "user_id": None}
+
+
+def _sensor_state(entity_id, value, now, rnd):
+    return {
+        "entity_id": entity_id,
+        "state": str(value),
+        "attributes": {
+            "state_class": "measurement",
+            "unit_of_measurement": "W",
+            "device_class": "power",
+            "friendly_name": entity_id.split(".")[1].replace("_", " "),
+        },
+        "last_changed": _timestamp(now),
+        "last_updated": _timestamp(now),
+        "context": _context(rnd),
+    }
+
+
+def _player_state(entity_id, track, position, volume, now, rnd):
+    return {
+        "entity_id": entity_id,
+        "state": "playing",
+        "attributes": {
+            "volume_level": volume,
+            "is_volume_muted": False,
+            "media_content_id": f"spotify:track:{track:022d}",
+            "media_content_type": "music",
+            "media_duration": 240,
+            "media_position": position,
+            "media_position_updated_at": _timestamp(now),
+            "media_title": f"Track {track}",
+            "media_artist": f"Artist {track % 17}",
+            "media_album_name": f"Album {track % 5}",
+            "source_list": ["Line in", "Bluetooth", "Spotify"],
+            "shuffle": False,
+            "repeat": "off",
+            "entity_picture": f"/api/media_player_proxy/{entity_id}?token=abc&cache={track}",
+            "friendly_name": entity_id.split(".")[1].replace("_", " "),
+            "supported_features": 4127295,
+        },
+        "last_changed": _timestamp(now),
+        "last_updated": _timestamp(now),
+        "context": _context(rnd),
+    }
+
+
+class Install:
+    """Synthetic installation with the given number of entities."""
+
+    def __init__(self, entities, seed=0):
+        self._rnd = random.Random(seed)  # noqa: S311
+        players = max(2, int(entities * PLAYER_RATIO))
+        self.players = [f"media_player.speaker_{i}" for i in range(players)]
+        self.sensors = [f"sensor.power_{i}" for i in range(entities - players)]
+        self._now = 0.0
+        self._states = {}
+        for entity_id in self.sensors:
+            self._states[entity_id] = _sensor_state(entity_id, 0, 0, self._rnd)
+        for i, entity_id in enumerate(self.players):
+            self._states[entity_id] = _player_state(entity_id, i, 0, 0.5, 0, self._rnd)
+
+    def get_states_frame(self) -> str:
+        """Return the get_states result frame."""
+        return dumps(
+            {
+                "id": GET_STATES_ID,
+                "type": "result",
+                "success": True,
+                "result": list(self._states.values()),
+            }
+        )
+
+    def entities_frame(self) -> str:
+        """Return the initial subscribe_entities event frame."""
+        added = {
+            entity_id: {
+                "s": state["state"],
+                "a": state["attributes"],
+                "c": state["context"]["id"],
+                "lc": _unix_time(0),
+            }
+            for entity_id, state in self._states.items()
+        }
+        return dumps({"id": SUBSCRIPTION_ID, "type": "event", "event": {"a": added}})
+
+    def _next_state(self, entity_id):
+        rnd = self._rnd
+        old = self._states[entity_id]
+        if entity_id.startswith("sensor."):
+            new = _sensor_state(entity_id, rnd.randint(0, 3000), self._now, rnd)
+        else:
+            attrs = old["attributes"]
+            track = int(attrs["media_content_id"].rsplit(":", 1)[1])
+            position = self._now % 240
+            volume = attrs["volume_level"]
+            kind = rnd.random()
+            if kind < 0.2:
+                track += 1
+                position = 0
+            elif kind < 0.5:
+                volume = round(rnd.random(), 2)
+            elif kind < 0.6:
+                # seek
+                position = rnd.randint(0, 239)
+            new = _player_state(entity_id, track, position, volume, self._now, rnd)
+
+        self._states[entity_id] = new
+        return old, new
+
+    def _changes(self, count):
+        """Yield `count` (entity_id, old_state, new_state) changes."""
+        for _ in range(count):
+            self._now += EVENT_INTERVAL
+            if self._rnd.random() < PLAYER_EVENT_RATIO:
+                entity_id = self._rnd.choice(self.players)
+            else:
+                entity_id = self._rnd.choice(self.sensors)
+            yield (entity_id, *self._next_state(entity_id))
+
+    def event_frames(self, count):
+        """Return `count` state_changed event frames."""
+        frames = []
+        for entity_id, old, new in self._changes(count):
+            event = {
+                "event_type": "state_changed",
+                "data": {"entity_id": entity_id, "old_state": old, "new_state": new},
+                "origin": "LOCAL",
+                "time_fired": new["last_updated"],
+                "context": new["context"],
+            }
+            frames.append(
+                dumps({"id": SUBSCRIPTION_ID, "type": "event", "event": event})
+            )
+
+        return frames
+
+    def entities_frames(self, count):
+        """Return `count` subscribe_entities diff frames."""
+        frames = []
+        for entity_id, old, new in self._changes(count):
+            additions = {"c": new["context"]["id"], "lu": _unix_time(self._now)}
+            if new["state"] != old["state"]:
+                additions["s"] = new["state"]
+            changed = {
+                key: value
+                for key, value in new["attributes"].items()
+                if old["attributes"].get(key) != value
+            }
+            if changed:
+                additions["a"] = changed
+            event = {"c": {entity_id: {"+": additions}}}
+            frames.append(
+                dumps({"id": SUBSCRIPTION_ID, "type": "event", "event": event})
+            )
+
+        return frames
@@ -1 +1,6 @@
 """Homeassistant-MPRIS bridge."""
+
+import time
+
+# start of importing the bridge, see `hassbridge --timing`
+IMPORT_STARTED = time.perf_counter()
@@ -0,0 +1,205 @@
+"""On-disk cache for album art.
+
+Images are downloaded once in the background using a small pool of worker threads
+keeping their HTTP connections alive, and clients are given file:// urls
+to the cached copies instead of each one fetching the image from homeassistant.
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import http.client
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def default_cache_dir() -> Path:
+    """Return the default cache directory."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "hassbridge" / "art"
+
+
+class ArtCache:
+    """Album art cache with size and count based LRU eviction."""
+
+    def __init__(
+        self,
+        directory=None,
+        endpoint=None,
+        token=None,
+        max_files=200,
+        max_bytes=50 * 1024 * 1024,
+        max_workers=2,
+        timeout=10,
+    ):
+        self.directory = Path(directory) if directory else default_cache_dir()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._timeout = timeout
+        # the token is only sent to the homeassistant instance it belongs to,
+        # not to the third party hosts serving some of the images
+        self._origin = urlsplit(endpoint)[:2] if endpoint else None
+        self._auth_headers = {}
+        if token is not None:
+            self._auth_headers["Authorization"] = f"Bearer {token}"
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hassbridge-art"
+        )
+        # per-thread connections, keyed by (scheme, netloc)
+        self._local = threading.local()
+        self._pending = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.errors = 0
+        self.evictions = 0
+
+        # file name -> size, in least recently used order
+        self._index = OrderedDict()
+        self._size = 0
+        files = sorted(
+            (
+                f
+                for f in self.directory.iterdir()
+                if f.is_file() and not f.name.startswith(".")
+            ),
+            key=lambda f: f.stat().st_mtime,
+        )
+        for file in files:
+            self._add(file.name, file.stat().st_size)
+        self._evict()
+
+    @staticmethod
+    def key(url) -> str:
+        """Return the cache key for the given url.
+
+        The media player proxy urls contain an access token which changes
+        periodically, so the cache token is used for those instead of the full url.
+        """
+        parsed = urlsplit(url)
+        cache = parse_qs(parsed.query).get("cache")
+        ident = f"{parsed.netloc}{parsed.path}#{cache[0]}" if cache else url
+
+        return hashlib.sha256(ident.encode()).hexdigest()
+
+    def get(self, url):
+        """Return a file:// url of the cached art, or None if it is not cached."""
+        name = self.key(url)
+        if name not in self._index:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._index.move_to_end(name)
+        return (self.directory / name).as_uri()
+
+    def touch(self, file_url) -> bool:
+        """Mark the cached file as recently used, return False if it got evicted."""
+        name = file_url.rpartition("/")[2]
+        if name not in self._index:
+            return False
+
+        self._index.move_to_end(name)
+        return True
+
+    def fetch(self, url, callback):
+        """Download the given url in the background and call callback when cached."""
+        name = self.key(url)
+        if name in self._pending or name in self._index:
+            return
+
+        loop = asyncio.get_running_loop()
+        self._pending[name] = loop.create_task(self._fetch(name, url, callback))
+
+    async def _fetch(self, name, url, callback):
+        loop = asyncio.get_running_loop()
+        try:
+            size = await loop.run_in_executor(self._executor, self._download, name, url)
+        except Exception as ex:
+            self.errors += 1
+            _LOGGER.warning("Unable to fetch art from %s: %s", url, ex)
+            return
+        finally:
+            self._pending.pop(name, None)
+
+        self.fetches += 1
+        self._add(name, size)
+        self._evict()
+        callback()
+
+    def _connection(self, scheme, netloc) -> http.client.HTTPConnection:
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+
+        conn = connections.get((scheme, netloc))
+        if conn is None:
+            conn_cls = (
+                http.client.HTTPSConnection
+                if scheme == "https"
+                else http.client.HTTPConnection
+            )
+            conn = connections[(scheme, netloc)] = conn_cls(
+                netloc, timeout=self._timeout
+            )
+
+        return conn
+
+    def _download(self, name, url) -> int:
+        """Download the url to the cache, executed in the worker threads."""
+        parsed = urlsplit(url)
+        path = parsed.path
+        if parsed.query:
+            path = f"{path}?{parsed.query}"
+        headers = {}
+        if (parsed.scheme, parsed.netloc) == self._origin:
+            headers = self._auth_headers
+
+        # retry once, in case the kept-alive connection was closed by the server
+        for attempt in range(2):
+            conn = self._connection(parsed.scheme, parsed.netloc)
+            try:
+                conn.request("GET", path, headers=headers)
+                res = conn.getresponse()
+                body = res.read()
+                break
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if attempt:
+                    raise
+
+        if res.status != 200:
+            raise OSError(f"Unexpected response: {res.status} {res.reason}")
+
+        tmp = self.directory / f".{name}.tmp"
+        tmp.write_bytes(body)
+        tmp.replace(self.directory / name)
+
+        return len(body)
+
+    def _add(self, name, size):
+        if name in self._index:
+            self._size -= self._index.pop(name)
+        self._index[name] = size
+        self._size += size
+
+    def _evict(self):
+        """Remove least recently used images until within the limits."""
+        while self._index and (
+            len(self._index) > self.max_files or self._size > self.max_bytes
+        ):
+            name, size = self._index.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            with contextlib.suppress(FileNotFoundError):
+                (self.directory / name).unlink()
@@ -0,0 +1,68 @@
+"""Session bus connection handling for the bridged players."""
+
+import logging
+
+from dbus_next.aio import MessageBus
+
+_LOGGER = logging.getLogger(__name__)
+
+MPRIS_PATH = "/org/mpris/MediaPlayer2"
+
+
+class BusPool:
+    """Pool of session bus connections shared by all bridged players.
+
+    The MPRIS spec requires every player to be exported at /org/mpris/MediaPlayer2,
+    and a single connection can only export one object per path, so every player
+    needs a connection of its own.
+    Connections released by removed players are kept around (up to `max_idle`)
+    and handed out to new players, avoiding new sockets and auth handshakes.
+
+    `bus_factory` is a coroutine function returning a connected bus,
+    which allows using the bridge without a session bus (e.g., for benchmarks).
+    """
+
+    def __init__(self, max_idle=4, bus_factory=None):
+        self.max_idle = max_idle
+        self._bus_factory = bus_factory or _connect
+        self._idle = []
+        self._in_use = set()
+        self.connections_opened = 0
+
+    @property
+    def open_connections(self) -> int:
+        """Return the number of currently open connections."""
+        return len(self._in_use) + len(self._idle)
+
+    async def acquire(self) -> MessageBus:
+        """Return a connected bus, reusing an idle connection if available."""
+        while self._idle:
+            bus = self._idle.pop()
+            if bus.connected:
+                break
+        else:
+            bus = await self._bus_factory()
+            self.connections_opened += 1
+
+        self._in_use.add(bus)
+        return bus
+
+    async def release(self, bus: MessageBus, name=None):
+        """Return the bus to the pool, unexporting the player and releasing its name."""
+        self._in_use.discard(bus)
+        bus.unexport(MPRIS_PATH)
+
+        if name is not None and bus.connected:
+            try:
+                await bus.release_name(name)
+            except Exception as ex:
+                _LOGGER.warning("Unable to release %s: %s", name, ex)
+
+        if bus.connected and len(self._idle) < self.max_idle:
+            self._idle.append(bus)
+        else:
+            bus.disconnect()
+
+
+async def _connect() -> MessageBus:
+    return await MessageBus().connect()
@@ -1,11 +1,19 @@
-"""hassbridge cli."""
+"""hassbridge cli.
 
+The subsystems (websockets, D-Bus, ...) are imported only by the commands
+needing them, to keep `--help` and the startup of the daemon fast.
+"""
+
+from __future__ import annotations
+
+import asyncio
 import logging
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 import asyncclick as click
 
-from hassbridge.hassinterface import HassInterface
+from hassbridge.codec import CODECS
+from hassbridge.tracing import TRACERS, configure_tracing
 
 click.anyio_backend = "asyncio"
 
@@ -17,16 +25,246 @@ class Settings:
     endpoint: str
     token: str
     debug: bool = False
+    subscription: str = "events"
+    entities: list[str] = field(default_factory=list)
+    include: list[str] = field(default_factory=list)
+    exclude: list[str] = field(default_factory=list)
+    areas: list[str] = field(default_factory=list)
+    device_classes: list[str] = field(default_factory=list)
+    attributes: list[str] = field(default_factory=list)
+    trace: list[str] = field(default_factory=list)
+    codec: str | None = None
+    command_interval: float = 0.25
+    art_cache: bool = True
+    record: str | None = None
+    metrics: str | None = None
+    remove_deleted: bool = True
+    remove_unavailable: bool = False
+    idle_timeout: float | None = None
+    config: str | None = None
+    optimistic: bool = False
+    timing: bool = False
+    coalesce: bool = True
+    compression: bool = True
+    compression_level: int | None = None
+    compression_window_bits: int | None = None
+    heartbeat_interval: float = 10
+    heartbeat_timeout: float = 5
 
 
 @click.group(invoke_without_command=True)
 @click.option("--endpoint", required=False, envvar="HASSBRIDGE_ENDPOINT")
 @click.option("--token", required=False, envvar="HASSBRIDGE_TOKEN")
 @click.option("-d", "--debug", is_flag=True)
+@click.option(
+    "--config",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    envvar="HASSBRIDGE_CONFIG",
+    help="Configuration file listing the homeassistant instances to bridge.",
+)
+@click.option(
+    "--subscription",
+    type=click.Choice(["events", "entities"]),
+    default="events",
+    envvar="HASSBRIDGE_SUBSCRIPTION",
+    help="Subscribe to all state_changed events, or to filtered entity diffs.",
+)
+@click.option(
+    "--entity",
+    "entities",
+    multiple=True,
+    help="Entity id to subscribe to, can be given multiple times (entities only).",
+)
+@click.option(
+    "--include",
+    multiple=True,
+    help="Bridge only players whose entity id matches the glob, can be given multiple times.",
+)
+@click.option(
+    "--exclude",
+    multiple=True,
+    help="Do not bridge players whose entity id matches the glob, can be given multiple times.",
+)
+@click.option(
+    "--area",
+    "areas",
+    multiple=True,
+    help="Bridge only players in the area (id or name), can be given multiple times.",
+)
+@click.option(
+    "--device-class",
+    "device_classes",
+    multiple=True,
+    help="Bridge only players of the device class, can be given multiple times.",
+)
+@click.option(
+    "--attribute",
+    "attributes",
+    multiple=True,
+    help="Bridge only players having the attribute (key, key=value or key!=value).",
+)
+@click.option(
+    "--trace",
+    type=click.Choice(list(TRACERS)),
+    multiple=True,
+    help="Enable debug tracing for the given subsystem, enabled for all with --debug.",
+)
+@click.option(
+    "--codec",
+    type=click.Choice(list(CODECS)),
+    default=None,
+    help="JSON backend to use, defaults to the fastest one installed.",
+)
+@click.option(
+    "--command-interval",
+    type=float,
+    default=0.25,
+    show_default=True,
+    help="Minimum interval in seconds between volume, seek, shuffle and repeat commands.",
+)
+@click.option(
+    "--art-cache/--no-art-cache",
+    default=True,
+    help="Cache album art locally and pass file:// urls to clients.",
+)
+@click.option(
+    "--record",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help="Record received websocket frames to the given file, for benchmarks.",
+)
+@click.option(
+    "--metrics",
+    default=None,
+    envvar="HASSBRIDGE_METRICS",
+    help="Serve Prometheus metrics on host:port or unix:/path/to/socket.",
+)
+@click.option(
+    "--remove-deleted/--keep-deleted",
+    default=True,
+    help="Remove players whose entity gets deleted from homeassistant.",
+)
+@click.option(
+    "--remove-unavailable/--keep-unavailable",
+    default=False,
+    help="Remove players while their entity is unavailable.",
+)
+@click.option(
+    "--optimistic",
+    is_flag=True,
+    help="Show the outcome of commands before homeassistant confirms them.",
+)
+@click.option(
+    "--timing",
+    is_flag=True,
+    help="Log the time taken by each startup phase until the players are exported.",
+)
+@click.option(
+    "--coalesce/--no-coalesce",
+    default=True,
+    help="Let homeassistant send several messages in a single frame.",
+)
+@click.option(
+    "--compression/--no-compression",
+    default=True,
+    help="Compress the websocket frames using permessage-deflate.",
+)
+@click.option(
+    "--compression-level",
+    type=click.IntRange(0, 9),
+    default=None,
+    help="zlib compression level for the frames sent by the bridge.",
+)
+@click.option(
+    "--compression-window-bits",
+    type=click.IntRange(9, 15),
+    default=None,
+    help="Compression window size, smaller values use less memory but compress worse.",
+)
+@click.option(
+    "--heartbeat-interval",
+    type=float,
+    default=10,
+    show_default=True,
+    help="Seconds between pinging homeassistant, 0 to disable.",
+)
+@click.option(
+    "--heartbeat-timeout",
+    type=float,
+    default=5,
+    show_default=True,
+    help="Seconds to wait for a pong before reconnecting.",
+)
+@click.option(
+    "--idle-timeout",
+    type=float,
+    default=None,
+    help="Remove players idle (e.g., off) for this many minutes.",
+)
 @click.pass_context
-async def cli(ctx, endpoint, token, debug):
+async def cli(
+    ctx,
+    endpoint,
+    token,
+    debug,
+    config,
+    subscription,
+    entities,
+    include,
+    exclude,
+    areas,
+    device_classes,
+    attributes,
+    trace,
+    codec,
+    command_interval,
+    art_cache,
+    record,
+    metrics,
+    remove_deleted,
+    remove_unavailable,
+    optimistic,
+    timing,
+    coalesce,
+    compression,
+    compression_level,
+    compression_window_bits,
+    heartbeat_interval,
+    heartbeat_timeout,
+    idle_timeout,
+):
     """hass-mpris bridge."""
-    ctx.obj = Settings(endpoint=endpoint, token=token, debug=debug)
+    ctx.obj = Settings(
+        endpoint=endpoint,
+        token=token,
+        debug=debug,
+        subscription=subscription,
+        entities=list(entities),
+        include=list(include),
+        exclude=list(exclude),
+        areas=list(areas),
+        device_classes=list(device_classes),
+        attributes=list(attributes),
+        trace=list(trace),
+        codec=codec,
+        command_interval=command_interval,
+        art_cache=art_cache,
+        record=record,
+        metrics=metrics,
+        remove_deleted=remove_deleted,
+        remove_unavailable=remove_unavailable,
+        idle_timeout=idle_timeout,
+        config=config,
+        optimistic=optimistic,
+        timing=timing,
+        coalesce=coalesce,
+        compression=compression,
+        compression_level=compression_level,
+        compression_window_bits=compression_window_bits,
+        heartbeat_interval=heartbeat_interval,
+        heartbeat_timeout=heartbeat_timeout,
+    )
 
     if ctx.invoked_subcommand is None:
         await ctx.invoke(start)
@@ -52,11 +290,170 @@ async def start(ctx):
     # this can be removed after that's fixed.
     logging.getLogger().setLevel(lvl)
 
-    logging.info("Endpoint: %s" % settings.endpoint)
+    configure_tracing(TRACERS if settings.debug else settings.trace)
+
+    from hassbridge import IMPORT_STARTED
+    from hassbridge.artcache import ArtCache, default_cache_dir
+    from hassbridge.buspool import BusPool
+    from hassbridge.config import ConfigError, InstanceConfig, load_config
+    from hassbridge.hassinterface import HassInterface
+    from hassbridge.metrics import MetricsServer, enable_metrics
+    from hassbridge.selection import EntitySelector
+    from hassbridge.stats import StartupTimer
+
+    if settings.config:
+        try:
+            instances = load_config(settings.config)
+        except ConfigError as ex:
+            raise click.UsageError(str(ex)) from ex
+    else:
+        instances = [
+            InstanceConfig(
+                name=None,
+                endpoint=settings.endpoint,
+                token=settings.token,
+                subscription=settings.subscription,
+                entities=settings.entities,
+                include=settings.include,
+                exclude=settings.exclude,
+                areas=settings.areas,
+                device_classes=settings.device_classes,
+                attributes=settings.attributes,
+            )
+        ]
+
+    # all instances share the session bus connections
+    bus_pool = BusPool()
+    hass_interfaces = []
+    for instance in instances:
+        logging.info("Endpoint: %s" % instance.endpoint)
+        art_cache = None
+        record_to = settings.record
+        if settings.art_cache:
+            directory = default_cache_dir()
+            if instance.name:
+                directory = directory / instance.name
+            art_cache = ArtCache(
+                directory, endpoint=instance.endpoint, token=instance.token
+            )
+        if record_to and instance.name:
+            record_to = f"{record_to}.{instance.name}"
+        startup_timer = None
+        if settings.timing:
+            startup_timer = StartupTimer(IMPORT_STARTED, instance.name)
+            startup_timer.mark("import")
+
+        hass_interfaces.append(
+            HassInterface(
+                instance.endpoint,
+                instance.token,
+                subscription=instance.subscription,
+                entity_ids=instance.entities,
+                selector=EntitySelector(
+                    include=instance.include,
+                    exclude=instance.exclude,
+                    areas=instance.areas,
+                    device_classes=instance.device_classes,
+                    attributes=instance.attributes,
+                ),
+                bus_pool=bus_pool,
+                codec=settings.codec,
+                command_interval=settings.command_interval,
+                art_cache=art_cache,
+                record_to=record_to,
+                remove_deleted=settings.remove_deleted,
+                remove_unavailable=settings.remove_unavailable,
+                idle_timeout=settings.idle_timeout * 60
+                if settings.idle_timeout
+                else None,
+                instance=instance.name,
+                optimistic=settings.optimistic,
+                startup_timer=startup_timer,
+                coalesce_messages=settings.coalesce,
+                compression=settings.compression,
+                compression_level=settings.compression_level,
+                compression_window_bits=settings.compression_window_bits,
+                heartbeat_interval=settings.heartbeat_interval,
+                heartbeat_timeout=settings.heartbeat_timeout,
+            )
+        )
+
+    if settings.metrics:
+        for h in hass_interfaces:
+            enable_metrics(h)
+        await MetricsServer(hass_interfaces, settings.metrics).start()
+
+    await asyncio.gather(*(h.start() for h in hass_interfaces))
+
+
+@cli.command()
+@click.pass_context
+async def stats(ctx):
+    """Print the metrics of a running bridge (started with --metrics)."""
+    settings: Settings = ctx.obj
+    if not settings.metrics:
+        raise click.UsageError("Give the metrics address using --metrics")
+
+    from hassbridge.metrics import fetch
+
+    for line in (await fetch(settings.metrics)).splitlines():
+        if not line.startswith("#"):
+            click.echo(line)
+
+
+@cli.command()
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8123, show_default=True)
+@click.option(
+    "--players", default=5, show_default=True, help="Number of media players."
+)
+@click.option(
+    "--entities", default=1000, show_default=True, help="Number of other entities."
+)
+@click.option(
+    "--rate",
+    default=10.0,
+    show_default=True,
+    help="State changes per second for the other entities.",
+)
+@click.option(
+    "--latency", default=0.0, show_default=True, help="Response delay in seconds."
+)
+@click.option(
+    "--disconnect-every",
+    type=float,
+    default=None,
+    help="Force a disconnect after about this many seconds.",
+)
+@click.option(
+    "--stall-every",
+    type=float,
+    default=None,
+    help="Silently stop responding on a connection after about this many seconds.",
+)
+@click.pass_context
+async def simulate(
+    ctx, host, port, players, entities, rate, latency, disconnect_every, stall_every
+):
+    """Run a simulated homeassistant websocket API for testing the bridge.
+
+    If --token is given, the clients are required to use it.
+    """
+    settings: Settings = ctx.obj
+    logging.basicConfig(level=logging.INFO)
 
-    h = HassInterface(settings.endpoint, settings.token)
+    from hassbridge.simulator import Simulator
 
-    await h.start()
+    simulator = Simulator(
+        players=players,
+        entities=entities,
+        rate=rate,
+        latency=latency,
+        disconnect_every=disconnect_every,
+        stall_every=stall_every,
+        token=settings.token,
+    )
+    await simulator.serve(host, port)
 
 
 if __name__ == "__main__":
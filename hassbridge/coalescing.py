@@ -0,0 +1,68 @@
+"""Queue merging pending entries with the same key."""
+
+import asyncio
+import itertools
+from collections import OrderedDict
+
+
+class CoalescingQueue:
+    """Bounded FIFO queue where the latest entry for a key wins.
+
+    An entry put with a key that is already queued replaces the queued value
+    in its place, so only the latest one gets processed.
+    Entries put without a key are never merged, and act as barriers:
+    keyed entries put after them are not merged into ones queued before them,
+    keeping the ordering relative to the barrier.
+
+    When the queue is full, `put` waits until there is space,
+    except when the entry can be merged.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._barriers = itertools.count()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+
+        self.merged = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def put(self, key, value):
+        """Queue the value, replacing a queued value with the same key."""
+        if key is None:
+            self._generation += 1
+            full_key = (self._generation, None, next(self._barriers))
+        else:
+            full_key = (self._generation, key)
+
+        if full_key not in self._entries:
+            while len(self._entries) >= self.maxsize:
+                self._not_full.clear()
+                await self._not_full.wait()
+
+        if full_key in self._entries:
+            self.merged += 1
+        self._entries[full_key] = value
+        self.max_depth = max(self.max_depth, len(self._entries))
+        self._not_empty.set()
+
+    async def get(self):
+        """Remove and return the oldest value, waiting for one if necessary."""
+        while not self._entries:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+
+        _, value = self._entries.popitem(last=False)
+        self._not_full.set()
+        return value
+
+    def clear(self):
+        """Drop all queued values."""
+        self._entries.clear()
+        self._not_full.set()
@@ -0,0 +1,78 @@
+"""JSON codecs for the websocket communication.
+
+orjson and msgspec are used when installed, falling back to the stdlib json module.
+"""
+
+import json
+from typing import Any, Callable, NamedTuple
+
+
+class Codec(NamedTuple):
+    """JSON encoder and decoder pair."""
+
+    name: str
+    loads: Callable[[Any], Any]
+    dumps: Callable[[Any], str]
+
+
+def _orjson_codec() -> Codec:
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    return Codec("orjson", orjson.loads, dumps)
+
+
+def _msgspec_codec() -> Codec:
+    import msgspec
+
+    decoder = msgspec.json.Decoder()
+    encoder = msgspec.json.Encoder()
+
+    def dumps(obj):
+        return encoder.encode(obj).decode()
+
+    return Codec("msgspec", decoder.decode, dumps)
+
+
+def _json_codec() -> Codec:
+    return Codec("json", json.loads, json.dumps)
+
+
+# in the order of preference
+CODECS = {
+    "orjson": _orjson_codec,
+    "msgspec": _msgspec_codec,
+    "json": _json_codec,
+}
+
+
+def get_codec(name=None) -> Codec:
+    """Return the codec with the given name, or the fastest available one.
+
+    Raises ImportError if the requested backend is not installed.
+    """
+    if name is not None:
+        return CODECS[name]()
+
+    for factory in CODECS.values():
+        try:
+            return factory()
+        except ImportError:
+            continue
+
+    raise ImportError("No JSON codec available")
+
+
+def available_codecs():
+    """Return names of the codecs usable in this environment."""
+    available = []
+    for name, factory in CODECS.items():
+        try:
+            factory()
+        except ImportError:
+            continue
+        available.append(name)
+
+    return available
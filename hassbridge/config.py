@@ -0,0 +1,99 @@
+"""Configuration file for bridging several homeassistant instances."""
+
+from __future__ import annotations
+
+import configparser
+import re
+from dataclasses import dataclass, field
+
+# instance names are used as a bus name element, see HassInterface.bus_name_for_entity
+_INSTANCE_NAME = re.compile("[A-Za-z_][A-Za-z0-9_]*")
+_SUBSCRIPTIONS = ("events", "entities")
+
+
+class ConfigError(Exception):
+    """The configuration file is invalid."""
+
+
+@dataclass
+class InstanceConfig:
+    """Settings for a single homeassistant instance."""
+
+    name: str | None
+    endpoint: str
+    token: str
+    subscription: str = "events"
+    entities: list[str] = field(default_factory=list)
+    include: list[str] = field(default_factory=list)
+    exclude: list[str] = field(default_factory=list)
+    areas: list[str] = field(default_factory=list)
+    device_classes: list[str] = field(default_factory=list)
+    attributes: list[str] = field(default_factory=list)
+
+
+def load_config(path) -> list[InstanceConfig]:
+    """Load the instances to bridge from an ini file, one section per instance.
+
+    The section name is used as the instance name, for example::
+
+        [home]
+        endpoint = http://homeassistant.local:8123
+        token = <long-lived access token>
+
+        [office]
+        endpoint = https://office.example.com
+        token = <long-lived access token>
+        subscription = entities
+        entities = media_player.meeting_room media_player.lobby
+
+    The lists (entities and the selection rules include, exclude, areas,
+    device_classes and attributes) are separated by whitespace or commas.
+    """
+    parser = configparser.ConfigParser(interpolation=None)
+    try:
+        with open(path) as f:
+            parser.read_file(f)
+    except (OSError, configparser.Error) as ex:
+        raise ConfigError(f"Unable to read {path}: {ex}") from ex
+
+    instances = []
+    for name in parser.sections():
+        section = parser[name]
+        if not _INSTANCE_NAME.fullmatch(name):
+            raise ConfigError(
+                f"Invalid instance name {name!r}, "
+                "use only letters, digits and underscores"
+            )
+
+        for required in ("endpoint", "token"):
+            if not section.get(required):
+                raise ConfigError(f"Missing {required} for instance {name}")
+
+        subscription = section.get("subscription", "events")
+        if subscription not in _SUBSCRIPTIONS:
+            raise ConfigError(
+                f"Invalid subscription {subscription!r} for instance {name}"
+            )
+
+        def get_list(key, section=section):
+            return section.get(key, "").replace(",", " ").split()
+
+        instances.append(
+            InstanceConfig(
+                name=name,
+                endpoint=section["endpoint"],
+                token=section["token"],
+                subscription=subscription,
+                entities=get_list("entities"),
+                include=get_list("include"),
+                exclude=get_list("exclude"),
+                areas=get_list("areas"),
+                device_classes=get_list("device_classes"),
+                attributes=get_list("attributes"),
+            )
+        )
+
+    if not instances:
+        raise ConfigError(f"No instances configured in {path}")
+
+    return instances
@@ -4,36 +4,234 @@ This implements the necessary parts of the homeassistant websocket API to commun
 and create/control the dbus interfaces.
 """
 
+from __future__ import annotations
+
 import asyncio
-import json
 import logging
-from pprint import pformat as pf
+import random
+import time
+from dataclasses import dataclass
+from typing import Any
 from urllib.parse import urlparse
 
 import websockets
-from dbus_next.aio import MessageBus
+from websockets.extensions.permessage_deflate import ClientPerMessageDeflateFactory
 
+from .buspool import MPRIS_PATH, BusPool
+from .coalescing import CoalescingQueue
+from .codec import get_codec
 from .mprismain import MPrisInterface
 from .playerinterface import PlayerInterface
+from .selection import EntitySelector
+from .stats import Histogram, RollingWindow
+from .tracing import Pretty, commands_trace, dispatch_trace, ws_trace
 
 _LOGGER = logging.getLogger(__name__)
 
+# Frames are checked for these before decoding, see `_is_relevant_frame`
+_EVENT_MARKER = '"type":"event"'
+_TYPE_MARKER = '"type":'
+_ENTITY_MARKER = "media_player."
+
+# Reconnect backoff in seconds, the first retry is done almost immediately
+RECONNECT_MIN_DELAY = 0.1
+RECONNECT_MAX_DELAY = 5
+# Interval for probing an unreachable homeassistant during the backoff
+RECONNECT_PROBE_INTERVAL = 0.25
+# Connections authenticated for longer than this reset the backoff
+RECONNECT_STABLE_AFTER = 30
+
+# Players in these states count as idle, see `idle_timeout`
+IDLE_STATES = frozenset({"off", "idle", "standby", "unavailable", "unknown"})
+# Maximum interval in seconds between checking for idle players
+IDLE_CHECK_INTERVAL = 60
+
+# Buckets for the latency of commands as perceived by the clients
+COMMAND_LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Number of the latest heartbeat round-trip times kept, see `_heartbeat`
+HEARTBEAT_RTT_WINDOW = 10
+
+# Registry listings used by the entity selection rules, see `load_registry`
+ENTITY_REGISTRY_LIST = "config/entity_registry/list"
+DEVICE_REGISTRY_LIST = "config/device_registry/list"
+AREA_REGISTRY_LIST = "config/area_registry/list"
+
+# Requests (re)syncing the state, never evicted from the pending requests
+UNEVICTABLE_REQUESTS = frozenset(
+    {
+        "subscribe_events",
+        "subscribe_entities",
+        "get_states",
+        ENTITY_REGISTRY_LIST,
+        DEVICE_REGISTRY_LIST,
+        AREA_REGISTRY_LIST,
+    }
+)
+
+
+class HassError(Exception):
+    """Homeassistant responded with an error."""
+
+
+@dataclass
+class PendingRequest:
+    """Request waiting for its result."""
+
+    data: dict[str, Any]
+    future: asyncio.Future
+    sent_at: float
+    timeout_handle: asyncio.TimerHandle
+
 
 class HassInterface:
     """Hass API interface, implements necessary parts of the websocket API."""
 
-    def __init__(self, endpoint, token):
+    def __init__(
+        self,
+        endpoint,
+        token,
+        subscription="events",
+        entity_ids=None,
+        bus_pool=None,
+        codec=None,
+        command_interval=0.25,
+        request_timeout=10,
+        bulk_request_timeout=300,
+        max_pending_requests=100,
+        art_cache=None,
+        record_to=None,
+        queue_size=1000,
+        remove_deleted=True,
+        remove_unavailable=False,
+        idle_timeout=None,
+        max_concurrent_creations=16,
+        instance=None,
+        selector=None,
+        optimistic=False,
+        optimistic_timeout=5,
+        startup_timer=None,
+        coalesce_messages=True,
+        compression=True,
+        compression_level=None,
+        compression_window_bits=None,
+        heartbeat_interval=10,
+        heartbeat_timeout=5,
+    ):
         self.ws = None
+        # name of the homeassistant instance when bridging several of them
+        self.instance = instance
         self.http_endpoint = endpoint
         parsed = urlparse(self.http_endpoint)
         self.ws_endpoint = parsed._replace(scheme="ws", path="/api/websocket").geturl()
 
         self._token = token
+        # let homeassistant send several messages in a single frame
+        self._coalesce_messages = coalesce_messages
+        # permessage-deflate, with the defaults of websockets unless tuned
+        self._compression = compression
+        self._compression_level = compression_level
+        self._compression_window_bits = compression_window_bits
+        self._art_cache = art_cache
+        # file to record the received frames to, used for replay benchmarks
+        self._record_to = record_to
+        self._record_file = None
 
         self._id = 0
         self._players = {}
+        self._buses = {}
+        # fingerprint of the last applied state per player, used for resyncing
+        self._fingerprints = {}
+        self.resync_skipped = 0
+        self._bus_pool = bus_pool if bus_pool is not None else BusPool()
+        # latest state per player being created in the background
+        self._creating = {}
+        self._creation_tasks = {}
+        self._max_concurrent_creations = max_concurrent_creations
+        self._creation_semaphore = None
+
+        # lifecycle policies for removing players, see `remove_player`
+        self._remove_deleted = remove_deleted
+        self._remove_unavailable = remove_unavailable
+        self._idle_timeout = idle_timeout
+        # monotonic time since when the player has been idle
+        self._idle_since = {}
+        self.players_removed = 0
+
+        self._pending_requests: dict[int, PendingRequest] = {}
+        self._request_timeout = request_timeout
+        # for the requests listing all states or registry entries,
+        # which take a while on large installations and slow links
+        self._bulk_request_timeout = bulk_request_timeout
+        self._max_pending_requests = max_pending_requests
+        # round-trip times per request type
+        self.request_latency: dict[str, Histogram] = {}
+        self.requests_timed_out = 0
+        self.requests_evicted = 0
+
+        # "events" subscribes to all state_changed events,
+        # "entities" uses subscribe_entities with its compressed diff format
+        self._subscription = subscription
+        self._entity_ids = entity_ids
+        self._selector = selector if selector is not None else EntitySelector()
+        self._subscriptions = {}
+        # local state table for subscribe_entities, contains only media players
+        self._states = {}
+        self._states_initialized = False
 
-        self._pending_requests = {}
+        self._codec = get_codec(codec)
+        _LOGGER.debug("Using %s for json", self._codec.name)
+
+        # latest pending parameters per (entity, command), see schedule_coalesced
+        self._command_interval = command_interval
+        self._coalesced = {}
+        self._coalescer_tasks = {}
+        self.commands_coalesced = 0
+
+        # show the expected outcome of commands before homeassistant confirms them
+        self.optimistic = optimistic
+        self.optimistic_timeout = optimistic_timeout
+        # time until the clients see the outcome of a command,
+        # and until homeassistant confirms it
+        self.perceived_latency = Histogram(COMMAND_LATENCY_BUCKETS)
+        self.confirmation_latency = Histogram(COMMAND_LATENCY_BUCKETS)
+
+        self.reconnects = 0
+        # ping homeassistant to notice silently dropped connections, see `_heartbeat`
+        self._heartbeat_interval = heartbeat_interval
+        self._heartbeat_timeout = heartbeat_timeout
+        self.heartbeat_rtt = RollingWindow(HEARTBEAT_RTT_WINDOW)
+        self.heartbeats_missed = 0
+        # StartupTimer measuring the time until the players are exported
+        self._startup_timer = startup_timer
+        # histogram for PropertiesChanged emit times, set when metrics are enabled
+        self.emit_latency = None
+
+        self.frames_received = 0
+        self.frames_discarded = 0
+        # several per frame when coalescing messages
+        self.messages_decoded = 0
+        self.events_discarded = 0
+
+        # decoded messages waiting for the worker, see `_dispatch`
+        self._queue_size = queue_size
+        self._queue = None
+        self._worker = None
 
     @property
     def _request_id(self) -> int:
@@ -42,16 +240,92 @@ class HassInterface:
         return self._id
 
     async def loop(self):
-        """Listen to homeassistant websocket communication forever."""
+        """Listen to homeassistant websocket communication forever.
+
+        Received messages are only decoded here, and handed over to a worker task
+        applying them to the players, so that slow D-Bus calls do not stall
+        reading from the websocket. See `_dispatch`.
+        """
+        self.start_worker()
+        try:
+            while True:
+                msg = await self.recv()
+                response = await self.handle_message(msg)
+                if response is not None:
+                    if ws_trace.enabled:
+                        ws_trace("sending response: %s", response)
+                    await self.ws.send(response)
+        finally:
+            self.stop_worker()
+            # fail the requests awaited elsewhere, see `connect`
+            self._fail_pending_requests(ConnectionError("Connection lost"))
+
+    def start_worker(self):
+        """Start the worker task processing the received messages."""
+        if self._queue is None:
+            self._queue = CoalescingQueue(self._queue_size)
+        self._worker = asyncio.ensure_future(self._process_queue())
+
+    def stop_worker(self):
+        """Stop the worker, dropping the messages it has not processed yet."""
+        if self._worker is None:
+            return
+
+        self._worker.cancel()
+        self._worker = None
+        # the new connection starts with a fresh state
+        self._queue.clear()
+
+    async def _dispatch(self, key, handler, *args):
+        """Run the handler, through the worker queue if the worker is running.
+
+        Queued handlers with the same key are merged, so that only the latest one
+        gets run. Handlers without a key are always run, in the order received.
+        When the queue is full, this waits until the worker catches up.
+        """
+        if self._worker is None:
+            return await handler(*args)
+
+        await self._queue.put(key, (handler, args))
+
+    async def _process_queue(self):
+        """Run the queued handlers until cancelled."""
         while True:
-            msg = await self.ws.recv()
-            response = await self.handle_message(msg)
-            if response is not None:
-                _LOGGER.debug("sending response: %s", response)
-                await self.ws.send(response)
+            handler, args = await self._queue.get()
+            try:
+                await handler(*args)
+            except Exception as ex:
+                _LOGGER.error("Unable to handle %s: %s", args, ex, exc_info=True)
+            # let the reader in to merge the updates received in the meanwhile
+            await asyncio.sleep(0)
+
+    @property
+    def updates_merged(self) -> int:
+        """Return the number of queued updates superseded by a later one."""
+        return self._queue.merged if self._queue is not None else 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Return the number of updates waiting for the worker."""
+        return len(self._queue) if self._queue is not None else 0
+
+    async def recv(self):
+        """Receive a frame, recording it if requested."""
+        msg = await self.ws.recv()
+        if ws_trace.enabled:
+            ws_trace("received: %s", msg)
+        if self._record_file is not None:
+            record = {"time": time.time(), "frame": msg}
+            self._record_file.write(self._codec.dumps(record) + "\n")
+
+        return msg
 
     async def execute_media_player_command(self, cmd, entity, params=None):
-        """Execute the given media_player command on the given entity."""
+        """Execute the given media_player command on the given entity.
+
+        Returns once homeassistant has responded,
+        raises HassError if the call failed and asyncio.TimeoutError on timeout.
+        """
         payload = {
             "type": "call_service",
             "domain": "media_player",
@@ -60,9 +334,13 @@ class HassInterface:
         }
         if params is not None:
             payload["service_data"].update(params)
-        _LOGGER.debug("Going to execute %s on %s (payload: %s)", cmd, entity, payload)
+        if commands_trace.enabled:
+            commands_trace(
+                "Going to execute %s on %s (payload: %s)", cmd, entity, payload
+            )
 
-        return await self._make_request(payload)
+        response = await self._make_request(payload)
+        return await response
 
     def schedule_execution(self, target, *args, **kwargs):
         """Schedule execution of a coroutine from non-asyncio code.
@@ -73,95 +351,325 @@ class HassInterface:
         task = loop.create_task(target(*args, **kwargs))
         return task
 
+    def schedule_coalesced(self, cmd, entity, params):
+        """Schedule a command for which only the latest value matters.
+
+        The first call is executed right away, after which the command is sent
+        at most once per `command_interval` for the entity.
+        Values given in the meanwhile supersede each other,
+        so only the latest one gets sent.
+        """
+        key = (entity, cmd)
+        if key in self._coalesced:
+            self.commands_coalesced += 1
+        self._coalesced[key] = params
+
+        if key not in self._coalescer_tasks:
+            self._coalescer_tasks[key] = self.schedule_execution(
+                self._execute_coalesced, key
+            )
+
+    async def _execute_coalesced(self, key):
+        """Send the latest pending value for the key until there is none left."""
+        entity, cmd = key
+        try:
+            while key in self._coalesced:
+                params = self._coalesced.pop(key)
+                try:
+                    await self.execute_media_player_command(cmd, entity, params=params)
+                except Exception as ex:
+                    _LOGGER.error("Unable to execute %s on %s: %s", cmd, entity, ex)
+                    # a newer value given in the meanwhile is still sent
+                    player = self._players.get(entity)
+                    if key not in self._coalesced and player is not None:
+                        player.rollback_expected()
+                await asyncio.sleep(self._command_interval)
+        finally:
+            self._coalescer_tasks.pop(key, None)
+
     def schedule_seek(self, seek_to, entity):
         """Schedule execution of media seeking."""
-        _LOGGER.debug("Requesting seek to %s on %s", seek_to, entity)
-        self.schedule_execution(
-            self.execute_media_player_command,
-            "media_seek",
-            entity,
-            params={"seek_position": seek_to},
-        )
+        if commands_trace.enabled:
+            commands_trace("Requesting seek to %s on %s", seek_to, entity)
+        self.schedule_coalesced("media_seek", entity, {"seek_position": seek_to})
 
     def schedule_set_volume(self, volume, entity):
         """Schedule volume setting."""
-        _LOGGER.debug("Scheduling volume set to %s on %s", volume, entity)
-        self.schedule_execution(
-            self.execute_media_player_command,
-            "volume_set",
-            entity,
-            params={"volume_level": volume},
-        )
+        if commands_trace.enabled:
+            commands_trace("Scheduling volume set to %s on %s", volume, entity)
+        self.schedule_coalesced("volume_set", entity, {"volume_level": volume})
 
     def schedule_set_shuffle(self, shuffle, entity):
         """Schedule setting shuffle."""
-        _LOGGER.debug("Scheduling shuffle set to %s on %s", shuffle, entity)
-        self.schedule_execution(
-            self.execute_media_player_command,
-            "shuffle_set",
-            entity,
-            params={"shuffle": shuffle},
-        )
+        if commands_trace.enabled:
+            commands_trace("Scheduling shuffle set to %s on %s", shuffle, entity)
+        self.schedule_coalesced("shuffle_set", entity, {"shuffle": shuffle})
 
     def schedule_set_repeat(self, repeat, entity):
         """Schedule setting repeat."""
-        _LOGGER.debug("Scheduling repeat set to %s on %s", repeat, entity)
-        self.schedule_execution(
-            self.execute_media_player_command,
-            "repeat_set",
-            entity,
-            params={"repeat": repeat},
-        )
+        if commands_trace.enabled:
+            commands_trace("Scheduling repeat set to %s on %s", repeat, entity)
+        self.schedule_coalesced("repeat_set", entity, {"repeat": repeat})
 
     async def update_player(self, entity, attrs):
         """Update (and create, if needed) the playback information.
 
         This gets called with the HASS API provided data during the
         initial state fetching, as well as for state change events.
+
+        Players not (or no longer) passing the selection rules are not bridged.
+        Depending on the lifecycle policies, unavailable players are removed,
+        and new players are created only once they are not idle.
+
+        New players are created in the background, see `_create_player`.
         """
-        if entity not in self._players:
-            _LOGGER.info("Found new device, creating an interface for %s" % entity)
-            self._players[entity] = await self.create_interface_for_entity(
-                entity, attrs
+        if not self._selector.matches(entity, attrs):
+            if entity in self._players or entity in self._creating:
+                _LOGGER.info("%s no longer matches the selection rules", entity)
+                await self.remove_player(entity)
+            return
+
+        state = attrs["state"]
+        if state == "unavailable" and self._remove_unavailable:
+            if entity in self._players or entity in self._creating:
+                _LOGGER.info("%s became unavailable", entity)
+                await self.remove_player(entity)
+            return
+
+        if self._idle_timeout is not None:
+            if state not in IDLE_STATES:
+                self._idle_since.pop(entity, None)
+            elif entity not in self._players and entity not in self._creating:
+                return
+            elif entity not in self._idle_since:
+                self._idle_since[entity] = time.monotonic()
+
+        if dispatch_trace.enabled:
+            dispatch_trace(
+                "Updating data for hass player %s: state: %s", entity, attrs["state"]
             )
+            dispatch_trace("got new state: %s", Pretty(attrs))
 
-        _LOGGER.debug(
-            "Updating data for hass player %s: state: %s", entity, attrs["state"]
-        )
-        _LOGGER.debug("got new state: %s", pf(attrs))
-        self._players[entity].update_data(attrs)
+        player = self._players.get(entity)
+        if player is None:
+            if entity not in self._creation_tasks:
+                _LOGGER.info("Found new device, creating an interface for %s" % entity)
+                self._creation_tasks[entity] = asyncio.ensure_future(
+                    self._create_player(entity)
+                )
+            # applied once the player has been created
+            self._creating[entity] = attrs
+            return
+
+        self._fingerprints[entity] = _fingerprint(attrs)
+        player.update_data(attrs)
+
+    async def _create_player(self, entity):
+        """Create the interfaces for the player, and apply the latest state to it.
+
+        Players are created concurrently, up to `max_concurrent_creations` at once.
+        Updates received in the meanwhile are buffered in `_creating`,
+        and the player is torn down if it got removed before being ready.
+        """
+        if self._creation_semaphore is None:
+            self._creation_semaphore = asyncio.Semaphore(self._max_concurrent_creations)
+
+        try:
+            async with self._creation_semaphore:
+                attrs = self._creating.get(entity)
+                if attrs is None:
+                    return
+                player = await self.create_interface_for_entity(entity, attrs)
+        except Exception as ex:
+            _LOGGER.error("Unable to create an interface for %s: %s", entity, ex)
+            self._creating.pop(entity, None)
+            return
+        finally:
+            self._creation_tasks.pop(entity, None)
+
+        latest = self._creating.pop(entity, None)
+        if latest is None:
+            _LOGGER.debug("%s was removed while being created", entity)
+            await self._bus_pool.release(
+                self._buses.pop(entity), self.bus_name_for_entity(entity)
+            )
+            return
+
+        self._players[entity] = player
+        self._fingerprints[entity] = _fingerprint(latest)
+        if latest is not attrs:
+            player.update_data(latest)
+
+    async def wait_for_players(self):
+        """Wait until the players being created are ready."""
+        while self._creation_tasks:
+            await asyncio.gather(*self._creation_tasks.values())
+
+    async def remove_player(self, entity):
+        """Unexport the interfaces of the player and release its bus name.
+
+        The player gets created again on its next update,
+        reusing a pooled bus connection.
+        """
+        _LOGGER.info("Removing interface for %s", entity)
+        # a player being created gets torn down once ready
+        self._creating.pop(entity, None)
+        if self._players.pop(entity, None) is not None:
+            self.players_removed += 1
+        self._fingerprints.pop(entity, None)
+        self._idle_since.pop(entity, None)
+        bus = self._buses.pop(entity, None)
+        if bus is not None:
+            await self._bus_pool.release(bus, self.bus_name_for_entity(entity))
 
     async def handle_event(self, msg):
-        """Handle state changed event for media_players."""
+        """Handle state changed event for media_players.
+
+        Deleted entities have no new state.
+        """
         data = msg["event"]["data"]
         entity = data["entity_id"]
-        if not entity.startswith("media_player."):
+        if not self._selector.matches_id(entity):
+            self.events_discarded += 1
             return
 
         attrs = data["new_state"]
-        await self.update_player(entity, attrs)
+        if attrs is None:
+            await self._dispatch(entity, self._remove_deleted_player, entity)
+            return
+
+        await self._dispatch(entity, self.update_player, entity, attrs)
+
+    async def handle_entities_event(self, msg):
+        """Handle subscribe_entities event for media_players.
+
+        The first event contains the full state of all (filtered) entities
+        under "a", and replaces the initial get_states call,
+        also when there are no entities.
+        Later events contain added entities ("a"), removed entities ("r"),
+        and compressed diffs ("c") which are applied to the local state table.
+        """
+        event = msg["event"]
+        initial = not self._states_initialized
+        self._states_initialized = True
+
+        states = []
+        for entity_id, compressed in event.get("a", {}).items():
+            if not self._selector.matches_id(entity_id):
+                continue
+            state = _expand_compressed_state(entity_id, compressed)
+            self._states[entity_id] = state
+            states.append(state)
+
+        if initial:
+            # the full snapshot even if empty, removing the players gone meanwhile
+            await self._dispatch(
+                None, self.handle_get_states_result, [dict(s) for s in states]
+            )
+        else:
+            for state in states:
+                entity_id = state["entity_id"]
+                await self._dispatch(
+                    entity_id, self.update_player, entity_id, dict(state)
+                )
+
+        for entity_id in event.get("r", []):
+            if self._states.pop(entity_id, None) is not None:
+                await self._dispatch(entity_id, self._remove_deleted_player, entity_id)
+
+        changed = event.get("c")
+        if changed:
+            for entity_id, diff in changed.items():
+                state = self._states.get(entity_id)
+                if state is None:
+                    continue
+                _apply_compressed_diff(state, diff)
+                await self._dispatch(
+                    entity_id, self.update_player, entity_id, dict(state)
+                )
 
     async def handle_get_states_result(self, res):
-        """Update states of currently playing devices."""
+        """Update states of currently playing devices.
+
+        After reconnecting, this resyncs the already known players:
+        players whose state has not changed are left untouched,
+        and players missing from the result are removed.
+        """
+        seen = set()
         for item in res:
             entity_id = item["entity_id"]
-            if not entity_id.startswith("media_player."):
+            if not self._selector.matches_id(entity_id):
                 continue
 
+            seen.add(entity_id)
             state = item["state"]
+            # Already known players are resynced after reconnecting
+            known = entity_id in self._players
+            if known and self._fingerprints.get(entity_id) == _fingerprint(item):
+                self._players[entity_id].stale = False
+                self.resync_skipped += 1
+                continue
+
             # Skip media_players that do not have volume level
             # This can happen, e.g., for grouped players
-            if "volume_level" not in item["attributes"]:
+            if not known and "volume_level" not in item["attributes"]:
                 continue
 
-            if state in ["playing", "paused"]:
+            if known or state in ["playing", "paused"]:
                 _LOGGER.debug(
-                    "%s is already playing/paused, adding/updating..", entity_id
+                    "%s is already known or playing/paused, adding/updating..",
+                    entity_id,
                 )
                 attrs = item["attributes"]
                 attrs["entity_id"] = entity_id
                 await self.update_player(entity_id, item)
 
+        removed = [
+            entity_id
+            for entity_id, player in self._players.items()
+            if player.stale and entity_id not in seen
+        ]
+        for entity_id in removed:
+            await self._remove_deleted_player(entity_id)
+
+        timer = self._startup_timer
+        if timer is not None and not timer.done:
+            timer.mark("initial_state")
+            asyncio.ensure_future(self._mark_exported())
+
+    async def _mark_exported(self):
+        await self.wait_for_players()
+        self._startup_timer.mark("bus_export")
+
+    async def _remove_deleted_player(self, entity):
+        """Remove the player of a deleted entity, if configured to do so."""
+        if entity not in self._players and entity not in self._creating:
+            return
+
+        if not self._remove_deleted:
+            _LOGGER.debug("%s was deleted, keeping it", entity)
+            return
+
+        _LOGGER.info("%s was deleted", entity)
+        await self.remove_player(entity)
+
+    async def _remove_idle_players(self):
+        """Remove players idle for longer than `idle_timeout`, until cancelled."""
+        while True:
+            await asyncio.sleep(min(self._idle_timeout, IDLE_CHECK_INTERVAL))
+            deadline = time.monotonic() - self._idle_timeout
+            for entity, since in list(self._idle_since.items()):
+                if since <= deadline:
+                    await self._dispatch(None, self._remove_idle_player, entity, since)
+
+    async def _remove_idle_player(self, entity, since):
+        """Remove the player, unless it has been active since `since`."""
+        if self._idle_since.get(entity) != since:
+            return
+
+        _LOGGER.info("%s has been idle for too long", entity)
+        await self.remove_player(entity)
+
     async def handle_call_service_result(self, res):
         """Handle call_service result."""
         pass
@@ -187,56 +695,279 @@ class HassInterface:
             return await self.handle_get_states_result(res)
         elif request_type == "call_service":
             return await self.handle_call_service_result(res)
+        elif request_type in (
+            "supported_features",
+            ENTITY_REGISTRY_LIST,
+            DEVICE_REGISTRY_LIST,
+            AREA_REGISTRY_LIST,
+        ):
+            # handled by load_registry
+            return
         else:
             _LOGGER.warning("unhandled request type: %s", request_type)
 
     async def handle_message(self, msg):
         """Parse incoming homeassistant messages."""
-        msg = json.loads(msg)
+        self.frames_received += 1
+        if not _is_relevant_frame(msg):
+            self.frames_discarded += 1
+            return
 
+        msg = self._codec.loads(msg)
+        if isinstance(msg, list):
+            # coalesced messages, see `enable_coalescing`
+            for item in msg:
+                await self._handle_decoded(item)
+            return
+
+        return await self._handle_decoded(msg)
+
+    async def _handle_decoded(self, msg):
+        """Handle a single decoded message."""
+        self.messages_decoded += 1
         if msg["type"] == "event":
-            return await self.handle_event(msg)
-        elif msg["type"] == "result":
-            request = self._pending_requests.pop(msg["id"], None)
-            if request is None:
+            handler = self._subscriptions.get(msg["id"])
+            if handler is None:
+                _LOGGER.debug("Got event for unknown subscription: %s", msg["id"])
+                return
+
+            return await handler(msg)
+        elif msg["type"] in ("result", "pong"):
+            pending = self._pending_requests.pop(msg["id"], None)
+            if pending is None:
                 _LOGGER.error("Got no request for %s", msg)
                 return
 
-            return await self.handle_result(msg, request)
+            pending.timeout_handle.cancel()
+            request_type = pending.data["type"]
+            latency = self.request_latency.get(request_type)
+            if latency is None:
+                latency = self.request_latency[request_type] = Histogram()
+            latency.observe(asyncio.get_running_loop().time() - pending.sent_at)
+
+            if not pending.future.done():
+                if msg.get("success") is False:
+                    pending.future.set_exception(HassError(msg["error"]))
+                else:
+                    pending.future.set_result(msg.get("result"))
+
+            if msg["type"] == "pong":
+                # handled by ping
+                return
+
+            return await self._dispatch(None, self.handle_result, msg, pending.data)
+
+    async def _make_request(
+        self, data, event_handler=None, timeout=None
+    ) -> asyncio.Future:
+        """Wrap the data to expected format and send it to to the ws endpoint.
+
+        If `event_handler` is given, it will be called for events
+        received for this request (i.e., subscriptions).
+
+        Returns a future resolved with the result once it has been received.
+        The future fails with HassError on unsuccessful calls,
+        and with asyncio.TimeoutError if no response arrives in `timeout` seconds
+        (defaults to `request_timeout`).
+        """
+        if self.ws is None:
+            raise ConnectionError("Not connected to homeassistant")
 
-    async def _make_request(self, data):
-        """Wrap the data to expected format and send it to to the ws endpoint."""
         _id = self._request_id
         data = {**data, "id": _id}
 
-        self._pending_requests[_id] = data
-        req = json.dumps(data)
+        if len(self._pending_requests) >= self._max_pending_requests:
+            self._evict_request()
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # avoid warnings about never retrieved exceptions for unawaited requests
+        future.add_done_callback(_retrieve_exception)
+        self._pending_requests[_id] = PendingRequest(
+            data=data,
+            future=future,
+            sent_at=loop.time(),
+            timeout_handle=loop.call_later(
+                timeout if timeout is not None else self._request_timeout,
+                self._expire_request,
+                _id,
+            ),
+        )
+        if event_handler is not None:
+            self._subscriptions[_id] = event_handler
+        req = self._codec.dumps(data)
+        if ws_trace.enabled:
+            ws_trace("sending: %s", req)
+
+        await self.ws.send(req)
+        return future
+
+    def _evict_request(self):
+        """Fail the oldest pending request, except those syncing the state.
+
+        Their results would be lost until the next reconnect,
+        so the limit can be exceeded by them.
+        """
+        request_id = next(
+            (
+                request_id
+                for request_id, pending in self._pending_requests.items()
+                if pending.data["type"] not in UNEVICTABLE_REQUESTS
+            ),
+            None,
+        )
+        if request_id is None:
+            return
+
+        _LOGGER.warning("Too many pending requests, evicting %s", request_id)
+        self.requests_evicted += 1
+        self._fail_request(request_id, HassError("Evicted from pending requests"))
+
+    def _fail_request(self, request_id, ex):
+        """Remove the pending request and fail its future with the given exception."""
+        pending = self._pending_requests.pop(request_id, None)
+        if pending is None:
+            return
+
+        pending.timeout_handle.cancel()
+        if not pending.future.done():
+            pending.future.set_exception(ex)
+
+    def _expire_request(self, request_id):
+        """Fail the request due to missing response."""
+        pending = self._pending_requests.get(request_id)
+        if pending is None:
+            return
+
+        _LOGGER.warning("No response for %s, giving up", pending.data)
+        self.requests_timed_out += 1
+        self._fail_request(request_id, asyncio.TimeoutError())
+
+    def _fail_pending_requests(self, ex):
+        """Fail all pending requests, used when the connection is lost."""
+        for request_id in list(self._pending_requests):
+            self._fail_request(request_id, ex)
+        self._subscriptions = {}
+
+    async def enable_coalescing(self):
+        """Ask homeassistant to coalesce the messages queued up for us into a frame.
+
+        This has to be the first request after auth. The result is not waited for,
+        as homeassistant handles the requests in order.
+        Versions not supporting it respond with an error, which is only logged.
+        """
+        payload = {"type": "supported_features", "features": {"coalesce_messages": 1}}
+        _LOGGER.debug("Enabling message coalescing")
+        return await self._make_request(payload)
+
+    async def ping(self) -> float:
+        """Ping homeassistant and return the round-trip time in seconds."""
+        loop = asyncio.get_running_loop()
+        sent = loop.time()
+        await (await self._make_request({"type": "ping"}))
+        return loop.time() - sent
 
-        return await self.ws.send(req)
+    async def _heartbeat(self):
+        """Ping homeassistant periodically, dropping the connection if it stops responding.
+
+        Otherwise a silently dropped connection (e.g., after a suspend or roaming)
+        would be noticed only once TCP gives up, showing stale players until then.
+        The round-trip times are kept in `heartbeat_rtt`.
+        """
+        while True:
+            await asyncio.sleep(self._heartbeat_interval)
+            try:
+                rtt = await asyncio.wait_for(self.ping(), self._heartbeat_timeout)
+            except ConnectionError:
+                # the connection got lost in the meanwhile
+                return
+            except asyncio.TimeoutError:
+                self.heartbeats_missed += 1
+                _LOGGER.warning(
+                    "No pong in %s seconds, dropping the connection",
+                    self._heartbeat_timeout,
+                )
+                # closing cleanly would wait for the dead peer
+                self.ws.transport.abort()
+                return
+            except HassError as ex:
+                # e.g., evicted from the pending requests, try again on the next round
+                _LOGGER.warning("Ping failed: %s", ex)
+                continue
+
+            self.heartbeat_rtt.observe(rtt)
 
     async def subscribe(self):
         """Subscribe to state_changed events."""
         payload = {"type": "subscribe_events", "event_type": "state_changed"}
         _LOGGER.debug("Going to subscribe to state_changed events..")
-        return await self._make_request(payload)
+        return await self._make_request(payload, event_handler=self.handle_event)
+
+    async def subscribe_entities(self):
+        """Subscribe to entity changes using the compressed diff format.
+
+        Contrary to state_changed events, the server can filter these on the given
+        entity ids, and the initial event contains the current states.
+        """
+        payload = {"type": "subscribe_entities"}
+        entity_ids = self._entity_ids or self._selector.subscription_filter()
+        if entity_ids:
+            payload["entity_ids"] = list(entity_ids)
+        self._states = {}
+        self._states_initialized = False
+        _LOGGER.debug("Going to subscribe to entities: %s", entity_ids or "all")
+        return await self._make_request(
+            payload, event_handler=self.handle_entities_event
+        )
+
+    async def load_registry(self):
+        """Load the registries needed by the entity selection rules.
+
+        The entity registry is used for the subscription filter,
+        and the device and area registries for resolving the entity areas.
+        """
+        request_types = [ENTITY_REGISTRY_LIST]
+        if self._selector.uses_areas:
+            request_types += [DEVICE_REGISTRY_LIST, AREA_REGISTRY_LIST]
+
+        _LOGGER.debug("Loading registries: %s", request_types)
+        responses = [
+            await self._make_request(
+                {"type": request_type}, timeout=self._bulk_request_timeout
+            )
+            for request_type in request_types
+        ]
+        self._selector.update_registry(*[await response for response in responses])
+
+    def _needs_registry(self) -> bool:
+        """Return True if the selection rules need the registries."""
+        if self._selector.uses_areas:
+            return True
+        return (
+            self._subscription == "entities"
+            and not self._entity_ids
+            and self._selector.filters_ids
+        )
 
     async def find_players(self):
         """Request all current states to find already active media players."""
         list_players_payload = {"type": "get_states"}
         _LOGGER.debug("Trying to find already existing, playing players..")
-        await self._make_request(list_players_payload)
+        await self._make_request(
+            list_players_payload, timeout=self._bulk_request_timeout
+        )
 
     async def handle_auth(self):
         """Handle authentication to hass ws api."""
-        req = await self.ws.recv()
-        res_json = json.loads(req)
+        req = await self.recv()
+        res_json = self._codec.loads(req)
 
         if "type" in res_json:
             if res_json["type"] == "auth_required":
                 await self.ws.send(
-                    json.dumps({"type": "auth", "access_token": self._token})
+                    self._codec.dumps({"type": "auth", "access_token": self._token})
                 )
-                auth_response = json.loads(await self.ws.recv())
+                auth_response = self._codec.loads(await self.recv())
                 if auth_response["type"] == "auth_ok":
                     _LOGGER.info(
                         "Successfully authed to %s, running %s",
@@ -249,46 +980,330 @@ class HassInterface:
                         "Unknown response/invalid token: %s" % auth_response
                     )
             else:
-                raise Exception(f"Unexpected type: {res.json['type']}")
+                raise Exception(f"Unexpected type: {res_json['type']}")
 
     async def start(self):
-        """Connect to homeassistant and start the communication loop."""
-        _LOGGER.info("Connecting to %s", self.ws_endpoint)
+        """Connect to homeassistant and keep reconnecting on errors.
 
+        Reconnecting is done with a jittered exponential backoff.
+        If homeassistant was unreachable (e.g., restarting), it is probed
+        during the backoff, reconnecting as soon as it accepts connections.
+        The exported players are kept over reconnects and marked stale,
+        and get resynced in place from the initial state of the new connection.
+        If `idle_timeout` is set, idle players are removed in the background.
+        """
+        loop = asyncio.get_running_loop()
+        delay = RECONNECT_MIN_DELAY
+        sweeper = None
+        if self._idle_timeout is not None:
+            sweeper = asyncio.ensure_future(self._remove_idle_players())
         try:
-            async with websockets.connect(self.ws_endpoint) as ws:
-                self.ws = ws
-                _LOGGER.info("Got connected, doing auth..")
-                await self.handle_auth()
+            while True:
+                authed = False
+                unreachable = False
+                started = loop.time()
+                try:
+                    authed = await self.connect()
+                except OSError as ex:
+                    unreachable = True
+                    _LOGGER.error("Unable to connect to %s: %s", self.ws_endpoint, ex)
+                except Exception as ex:
+                    _LOGGER.error(
+                        "Got error during communication: %s", ex, exc_info=True
+                    )
+                finally:
+                    self.ws = None
+                    self._fail_pending_requests(ConnectionError("Connection lost"))
+                    for player in self._players.values():
+                        player.stale = True
 
-                _LOGGER.info("Auth success, subscribing for events")
-                await self.subscribe()
+                # start from the beginning if the connection was working fine
+                if authed and loop.time() - started > RECONNECT_STABLE_AFTER:
+                    delay = RECONNECT_MIN_DELAY
 
-                _LOGGER.info("Finding already playing players")
-                await self.find_players()
+                sleep_for = delay * random.uniform(0.5, 1.5)  # noqa: S311
+                if unreachable:
+                    _LOGGER.info(
+                        "Reconnecting once reachable, in at most %.1f seconds",
+                        sleep_for,
+                    )
+                    await self._wait_until_reachable(sleep_for)
+                else:
+                    _LOGGER.info("Reconnecting in %.1f seconds", sleep_for)
+                    await asyncio.sleep(sleep_for)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                self.reconnects += 1
+        finally:
+            if sweeper is not None:
+                sweeper.cancel()
 
+    async def _wait_until_reachable(self, timeout):
+        """Wait until homeassistant accepts TCP connections, at most `timeout` seconds.
+
+        Opening a TCP connection is cheap compared to the websocket handshake,
+        so it can be probed often to reconnect right after a restart.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        parsed = urlparse(self.ws_endpoint)
+        while True:
+            probed_at = loop.time()
+            remaining = deadline - probed_at
+            if remaining <= 0:
+                return
+
+            try:
+                _, writer = await asyncio.wait_for(
+                    asyncio.open_connection(parsed.hostname, parsed.port or 80),
+                    min(RECONNECT_PROBE_INTERVAL, remaining),
+                )
+            except (OSError, asyncio.TimeoutError):
+                next_probe = min(probed_at + RECONNECT_PROBE_INTERVAL, deadline)
+                await asyncio.sleep(next_probe - loop.time())
+                continue
+
+            writer.close()
+            return
+
+    async def connect(self) -> bool:
+        """Connect to homeassistant and run the communication loop until it fails.
+
+        Returns True if the connection got authenticated before failing.
+        """
+        _LOGGER.info("Connecting to %s", self.ws_endpoint)
+
+        if self._record_to is not None and self._record_file is None:
+            _LOGGER.info("Recording received frames to %s", self._record_to)
+            self._record_file = open(self._record_to, "a")  # noqa: SIM115
+
+        async with websockets.connect(
+            self.ws_endpoint, **self._connect_options()
+        ) as ws:
+            self.ws = ws
+            if self._startup_timer is not None:
+                self._startup_timer.mark("connect")
+            _LOGGER.info("Got connected, doing auth..")
+            await self.handle_auth()
+            if self._startup_timer is not None:
+                self._startup_timer.mark("auth")
+
+            try:
                 _LOGGER.info("Starting main loop")
-                await self.loop()
-        except Exception as ex:
-            _LOGGER.error("Got error during communication: %s", ex, exc_info=True)
-            await asyncio.sleep(5)
-            await self.start()
+                loop_task = asyncio.ensure_future(self.loop())
+                heartbeat = None
+                if self._heartbeat_interval:
+                    heartbeat = asyncio.ensure_future(self._heartbeat())
+                try:
+                    if self._coalesce_messages:
+                        await self.enable_coalescing()
+
+                    if self._needs_registry():
+                        _LOGGER.info("Auth success, loading registries")
+                        try:
+                            await self.load_registry()
+                        except (HassError, asyncio.TimeoutError) as ex:
+                            _LOGGER.error("Unable to load the registries: %r", ex)
+
+                    if self._subscription == "entities":
+                        _LOGGER.info("Subscribing for entities")
+                        await self.subscribe_entities()
+                    else:
+                        _LOGGER.info("Subscribing for events")
+                        await self.subscribe()
+
+                        _LOGGER.info("Finding already playing players")
+                        await self.find_players()
+
+                    await loop_task
+                finally:
+                    loop_task.cancel()
+                    if heartbeat is not None:
+                        heartbeat.cancel()
+            except Exception as ex:
+                _LOGGER.error("Got error during communication: %s", ex, exc_info=True)
+
+        return True
+
+    def _connect_options(self) -> dict[str, Any]:
+        """Return the keepalive and permessage-deflate options for websockets.connect."""
+        options: dict[str, Any] = {}
+        if self._heartbeat_interval:
+            # replaced by the heartbeat
+            options["ping_interval"] = None
+
+        if not self._compression:
+            return {**options, "compression": None}
+        if self._compression_level is None and self._compression_window_bits is None:
+            return {**options, "compression": "deflate"}
+
+        compress_settings = {"memLevel": 5}
+        if self._compression_level is not None:
+            compress_settings["level"] = self._compression_level
+        window_bits = self._compression_window_bits
+        return {
+            **options,
+            "compression": None,
+            "extensions": [
+                ClientPerMessageDeflateFactory(
+                    # smaller windows use less memory, but compress worse
+                    server_max_window_bits=window_bits,
+                    client_max_window_bits=window_bits or True,
+                    compress_settings=compress_settings,
+                )
+            ],
+        }
+
+    def art_url(self, entity_picture, on_cached=None):
+        """Return the url for the given entity picture.
+
+        With the art cache enabled, this returns a file:// url to the cached image.
+        If the image is not yet cached, the http url is returned and the image
+        is fetched in the background, calling `on_cached` once it is available.
+        """
+        if entity_picture.startswith(("http://", "https://")):
+            url = entity_picture
+        else:
+            url = f"{self.http_endpoint}{entity_picture}"
+
+        if self._art_cache is None:
+            return url
+
+        cached = self._art_cache.get(url)
+        if cached is not None:
+            return cached
+
+        if on_cached is not None:
+            self._art_cache.fetch(url, on_cached)
+
+        return url
+
+    def touch_art(self, url) -> bool:
+        """Mark the art url returned by `art_url` as in use.
+
+        This keeps the cached image from being evicted while it is shown,
+        returning False if it already got evicted.
+        """
+        if self._art_cache is None or not url.startswith("file:"):
+            return True
+
+        return self._art_cache.touch(url)
+
+    def bus_name_for_entity(self, player_entity) -> str:
+        """Return the bus name used for the given homeassistant player.
+
+        With several instances, the names are namespaced by the instance name.
+        """
+        if self.instance:
+            return f"org.mpris.MediaPlayer2.hassbridge.{self.instance}.{player_entity}"
+        return f"org.mpris.MediaPlayer2.hassbridge.{player_entity}"
 
     async def create_interface_for_entity(
         self, player_entity, entity
     ) -> PlayerInterface:
         """Create mpris interfaces for given homeassistant player."""
-        bus = await MessageBus().connect()
+        bus = await self._bus_pool.acquire()
 
         interface = MPrisInterface("org.mpris.MediaPlayer2", self, entity)
         player_interface = PlayerInterface(
             "org.mpris.MediaPlayer2.Player", self, entity
         )
 
-        bus.export("/org/mpris/MediaPlayer2", interface)
-        bus.export("/org/mpris/MediaPlayer2", player_interface)
+        bus.export(MPRIS_PATH, interface)
+        bus.export(MPRIS_PATH, player_interface)
 
         # register ourselves using the entity id
-        await bus.request_name(f"org.mpris.MediaPlayer2.hassbridge.{player_entity}")
+        try:
+            await bus.request_name(self.bus_name_for_entity(player_entity))
+        except Exception:
+            await self._bus_pool.release(bus)
+            raise
+
+        self._buses[player_entity] = bus
+        _LOGGER.debug(
+            "%s D-Bus connections open (%s opened in total)",
+            self._bus_pool.open_connections,
+            self._bus_pool.connections_opened,
+        )
 
         return player_interface
+
+
+def _fingerprint(state):
+    """Return a value identifying the given version of the entity state."""
+    context = state.get("context") or {}
+    return state.get("last_updated"), context.get("id")
+
+
+def _retrieve_exception(future):
+    """Mark the exception of the future as retrieved."""
+    if not future.cancelled():
+        future.exception()
+
+
+def _is_relevant_frame(frame) -> bool:
+    """Return False for raw event frames that cannot concern a media player.
+
+    Homeassistant serializes messages compactly with the id and type first,
+    so event frames can be recognized from their beginning.
+    Every event for a media player (state_changed or subscribe_entities)
+    contains its entity id, so events without the domain can be dropped
+    without decoding them. Anything unrecognized is passed on to be decoded.
+
+    Coalesced frames (arrays of messages) are dropped only if all the messages
+    are events, i.e., every type in the frame is an event.
+    """
+    if not isinstance(frame, str):
+        return True
+
+    if frame[:1] == "[":
+        if _ENTITY_MARKER in frame:
+            return True
+        return frame.count(_TYPE_MARKER) != frame.count(_EVENT_MARKER)
+
+    if _EVENT_MARKER not in frame[:40]:
+        return True
+
+    return _ENTITY_MARKER in frame
+
+
+def _expand_compressed_state(entity_id, compressed):
+    """Convert a compressed subscribe_entities state to the get_states format."""
+    context = compressed.get("c")
+    if isinstance(context, str):
+        context = {"id": context}
+
+    last_changed = compressed.get("lc")
+    return {
+        "entity_id": entity_id,
+        "state": compressed["s"],
+        "attributes": dict(compressed.get("a", {})),
+        "context": context,
+        "last_changed": last_changed,
+        "last_updated": compressed.get("lu", last_changed),
+    }
+
+
+def _apply_compressed_diff(state, diff):
+    """Apply a compressed subscribe_entities diff to the given state in place."""
+    additions = diff.get("+")
+    if additions:
+        if "s" in additions:
+            state["state"] = additions["s"]
+        if "a" in additions:
+            state["attributes"] = {**state["attributes"], **additions["a"]}
+        if "c" in additions:
+            context = additions["c"]
+            if isinstance(context, str):
+                context = {"id": context}
+            state["context"] = context
+        if "lc" in additions:
+            state["last_changed"] = state["last_updated"] = additions["lc"]
+        if "lu" in additions:
+            state["last_updated"] = additions["lu"]
+
+    removals = diff.get("-")
+    if removals and "a" in removals:
+        attributes = dict(state["attributes"])
+        for key in removals["a"]:
+            attributes.pop(key, None)
+        state["attributes"] = attributes
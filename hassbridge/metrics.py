@@ -0,0 +1,334 @@
+"""Runtime metrics in the Prometheus text exposition format.
+
+The metrics are collected from the counters kept by the bridge when scraped,
+so there is no cost for them unless the metrics server is enabled.
+The only exception is timing the D-Bus signal emits, which is done only
+after `enable_metrics` has been called.
+"""
+
+import asyncio
+import logging
+
+from .stats import Histogram
+
+_LOGGER = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def enable_metrics(hass):
+    """Enable collecting metrics with a runtime cost."""
+    hass.emit_latency = Histogram(
+        (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+    )
+
+
+class _Writer:
+    def __init__(self):
+        self.lines = []
+
+    def metric(self, name, kind, description, samples):
+        """Add a metric with its (labels, value) samples."""
+        self.lines.append(f"# HELP hassbridge_{name} {description}")
+        self.lines.append(f"# TYPE hassbridge_{name} {kind}")
+        for labels, value in samples:
+            self.lines.append(f"hassbridge_{name}{_labels(labels)} {value}")
+
+    def histogram(self, name, description, samples):
+        """Add a histogram metric with its (labels, histogram) samples."""
+        self.lines.append(f"# HELP hassbridge_{name} {description}")
+        self.lines.append(f"# TYPE hassbridge_{name} histogram")
+        for labels, histogram in samples:
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                bucket_labels = {**labels, "le": repr(float(bound))}
+                self.lines.append(
+                    f"hassbridge_{name}_bucket{_labels(bucket_labels)} {cumulative}"
+                )
+            inf_labels = {**labels, "le": "+Inf"}
+            self.lines.append(
+                f"hassbridge_{name}_bucket{_labels(inf_labels)} {histogram.count}"
+            )
+            self.lines.append(f"hassbridge_{name}_sum{_labels(labels)} {histogram.sum}")
+            self.lines.append(
+                f"hassbridge_{name}_count{_labels(labels)} {histogram.count}"
+            )
+
+
+def _labels(labels) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    return f"{{{inner}}}"
+
+
+def collect(instances) -> str:
+    """Return the current metrics of the given HassInterfaces.
+
+    The metrics are labeled with the instance name when bridging several
+    homeassistant instances.
+    """
+    out = _Writer()
+
+    def labels(hass):
+        return {"instance": hass.instance} if hass.instance else {}
+
+    def counter(name, description, value):
+        samples = [(labels(hass), value(hass)) for hass in instances]
+        out.metric(name, "counter", description, samples)
+
+    def gauge(name, description, value):
+        samples = [(labels(hass), value(hass)) for hass in instances]
+        out.metric(name, "gauge", description, samples)
+
+    def players_sum(attribute):
+        return lambda hass: sum(
+            getattr(player, attribute) for player in hass._players.values()
+        )
+
+    counter(
+        "frames_received_total",
+        "Websocket frames received.",
+        lambda hass: hass.frames_received,
+    )
+    counter(
+        "frames_discarded_total",
+        "Event frames dropped before decoding.",
+        lambda hass: hass.frames_discarded,
+    )
+    counter(
+        "messages_decoded_total",
+        "Decoded messages, several per frame when homeassistant coalesces them.",
+        lambda hass: hass.messages_decoded,
+    )
+    counter(
+        "events_discarded_total",
+        "Decoded events not concerning media players.",
+        lambda hass: hass.events_discarded,
+    )
+    gauge("players", "Bridged media players.", lambda hass: len(hass._players))
+    counter(
+        "players_removed_total",
+        "Players removed as deleted, unavailable or idle.",
+        lambda hass: hass.players_removed,
+    )
+    gauge(
+        "players_stale",
+        "Players waiting to be resynced.",
+        lambda hass: sum(1 for player in hass._players.values() if player.stale),
+    )
+    gauge(
+        "pending_requests",
+        "Requests waiting for a response.",
+        lambda hass: len(hass._pending_requests),
+    )
+    counter(
+        "reconnects_total",
+        "Reconnects to homeassistant.",
+        lambda hass: hass.reconnects,
+    )
+    gauge(
+        "heartbeat_rtt_seconds",
+        "Mean round-trip time of the latest heartbeats.",
+        lambda hass: hass.heartbeat_rtt.mean,
+    )
+    gauge(
+        "heartbeat_rtt_max_seconds",
+        "Largest round-trip time of the latest heartbeats.",
+        lambda hass: hass.heartbeat_rtt.max,
+    )
+    counter(
+        "heartbeats_missed_total",
+        "Heartbeats without a pong in time, each dropping the connection.",
+        lambda hass: hass.heartbeats_missed,
+    )
+    counter(
+        "requests_timed_out_total",
+        "Requests without a response in time.",
+        lambda hass: hass.requests_timed_out,
+    )
+    counter(
+        "requests_evicted_total",
+        "Requests evicted from the full pending table.",
+        lambda hass: hass.requests_evicted,
+    )
+    counter(
+        "commands_coalesced_total",
+        "Commands superseded by a later value.",
+        lambda hass: hass.commands_coalesced,
+    )
+    gauge(
+        "queue_depth",
+        "Updates waiting for the worker.",
+        lambda hass: hass.queue_depth,
+    )
+    counter(
+        "updates_merged_total",
+        "Queued updates superseded by a later one.",
+        lambda hass: hass.updates_merged,
+    )
+    counter(
+        "resync_skipped_total",
+        "Unchanged players skipped when resyncing.",
+        lambda hass: hass.resync_skipped,
+    )
+    out.histogram(
+        "request_duration_seconds",
+        "Round-trip time of requests to homeassistant.",
+        [
+            ({**labels(hass), "type": type_}, histogram)
+            for hass in instances
+            for type_, histogram in sorted(hass.request_latency.items())
+        ],
+    )
+
+    counter(
+        "properties_emitted_total",
+        "Properties signaled with PropertiesChanged.",
+        players_sum("properties_emitted"),
+    )
+    counter(
+        "properties_suppressed_total",
+        "Unchanged properties not signaled.",
+        players_sum("properties_suppressed"),
+    )
+    counter(
+        "seeks_signaled_total",
+        "Seeked signals emitted.",
+        players_sum("seeks_signaled"),
+    )
+    out.histogram(
+        "command_perceived_latency_seconds",
+        "Time until the clients see the outcome of a command.",
+        [(labels(hass), hass.perceived_latency) for hass in instances],
+    )
+    out.histogram(
+        "command_confirmation_latency_seconds",
+        "Time until homeassistant confirms the outcome of a command.",
+        [(labels(hass), hass.confirmation_latency) for hass in instances],
+    )
+    counter(
+        "optimistic_rollbacks_total",
+        "Optimistic changes rolled back as failed or not confirmed in time.",
+        players_sum("rollbacks"),
+    )
+    emit_latencies = [
+        (labels(hass), hass.emit_latency)
+        for hass in instances
+        if hass.emit_latency is not None
+    ]
+    if emit_latencies:
+        out.histogram(
+            "dbus_emit_duration_seconds",
+            "Time taken to emit PropertiesChanged.",
+            emit_latencies,
+        )
+
+    # the bus connections are shared by the instances
+    bus_pools = {id(hass._bus_pool): hass._bus_pool for hass in instances}
+    out.metric(
+        "dbus_connections",
+        "gauge",
+        "Open session bus connections.",
+        [({}, sum(pool.open_connections for pool in bus_pools.values()))],
+    )
+
+    art_caches = [
+        (labels(hass), hass._art_cache)
+        for hass in instances
+        if hass._art_cache is not None
+    ]
+    art_cache_metrics = (
+        ("art_cache_hits_total", "Album art cache hits.", "hits"),
+        ("art_cache_misses_total", "Album art cache misses.", "misses"),
+        ("art_cache_fetches_total", "Album art downloads.", "fetches"),
+        ("art_cache_errors_total", "Failed album art downloads.", "errors"),
+    )
+    if art_caches:
+        for name, description, attribute in art_cache_metrics:
+            samples = [
+                (cache_labels, getattr(cache, attribute))
+                for cache_labels, cache in art_caches
+            ]
+            out.metric(name, "counter", description, samples)
+
+    return "\n".join(out.lines) + "\n"
+
+
+def parse_address(address):
+    """Parse `host:port`, `:port` or `unix:/path` to (host, port, path)."""
+    if address.startswith("unix:"):
+        return None, None, address[len("unix:") :]
+
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port), None
+
+
+class MetricsServer:
+    """Minimal HTTP server exposing the metrics on a local port or a unix socket."""
+
+    def __init__(self, instances, address):
+        self.instances = instances
+        self.address = address
+        self._server = None
+
+    async def start(self):
+        """Start serving."""
+        host, port, path = parse_address(self.address)
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port)
+        _LOGGER.info("Serving metrics on %s", self.address)
+
+    async def stop(self):
+        """Stop serving."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            # skip the headers
+            while (await reader.readline()).strip():
+                pass
+
+            parts = request.split()
+            if len(parts) < 2 or parts[0] != b"GET":
+                status, body = "405 Method Not Allowed", ""
+            else:
+                status, body = "200 OK", collect(self.instances)
+
+            payload = body.encode()
+            writer.write(
+                (
+                    f"HTTP/1.0 {status}\r\n"
+                    f"Content-Type: {CONTENT_TYPE}\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n"
+                ).encode()
+                + payload
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def fetch(address) -> str:
+    """Fetch the metrics from a running bridge."""
+    host, port, path = parse_address(address)
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+
+    writer.write(b"GET /metrics HTTP/1.0\r\n\r\n")
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    _, _, body = response.partition(b"\r\n\r\n")
+    return body.decode()
@@ -1,10 +1,14 @@
 """Player control implementation (org.mpris.MediaPlayer2.Player)."""
 
+import asyncio
 import logging
 import re
+import time
 from enum import IntFlag
-from typing import TYPE_CHECKING
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any
 
+from dbus_next import DBusError, ErrorType
 from dbus_next.service import (
     PropertyAccess,
     ServiceInterface,
@@ -14,6 +18,9 @@ from dbus_next.service import (
     signal,
 )
 
+from .playerstate import PlayerState
+from .tracing import Pretty, dbus_trace
+
 if TYPE_CHECKING:
     from .hassinterface import HassInterface
 
@@ -34,7 +41,46 @@ FLAG_GONEXT = 32
 FLAG_SHUFFLE = 32768
 FLAG_REPEAT = 262144
 
-from enum import IntFlag
+# Position changes more than this (in seconds) from its extrapolated value
+# are signaled using Seeked
+SEEK_TOLERANCE = 2.0
+
+# Properties signaled using PropertiesChanged on updates,
+# Position is not part of these as per spec
+EMITTED_PROPERTIES = [
+    "Metadata",
+    "PlaybackStatus",
+    "Rate",
+    "Shuffle",
+    "LoopStatus",
+    "Volume",
+    "CanSeek",
+    "CanGoNext",
+    "CanGoPrevious",
+]
+
+# Reported volume levels within this from the requested one confirm a volume change
+VOLUME_TOLERANCE = 0.01
+
+
+# Fields used to build Metadata, it gets rebuilt only when these change
+METADATA_ATTRIBUTES = (
+    "media_content_id",
+    "media_title",
+    "media_album_name",
+    "media_artist",
+    "media_duration",
+    "entity_picture",
+)
+
+_INVALID_TRACKID_CHARS = re.compile("[^0-9a-zA-Z_]")
+
+
+@lru_cache(maxsize=256)
+def _track_id(content_id) -> str:
+    """Return a valid object path for the given content id."""
+    content_id = _INVALID_TRACKID_CHARS.sub("_", content_id)
+    return f"/fi/iki/tpr/hassbridge/{content_id}"
 
 
 class MediaPlayerEntityFeature(IntFlag):
@@ -72,71 +118,280 @@ class PlayerInterface(ServiceInterface):
         _LOGGER.debug("Initializing %s", name)
         super().__init__(name)
         self.hass_interface = hass_interface
-        self.update_data(entity)
+        # the last state from homeassistant, and the state shown to the clients
+        self._confirmed = PlayerState.from_state(entity)
+        self.data = self._confirmed
+        self.entity = self._confirmed.entity_id
+        # set when the connection to homeassistant is lost, until resynced
+        self.stale = False
+        self.seeks_signaled = 0
+        self._metadata_key: tuple | None = None
+        self._metadata: dict[str, Variant] = {}
+        # the published art url, kept recently used in the art cache
+        self._art_url: str | None = None
+
+        # last emitted value per property, used to emit only changed properties
+        self._emitted: dict[str, Any] = {}
+        self.properties_emitted = 0
+        self.properties_suppressed = 0
+        self.signals_suppressed = 0
+
+        # expected outcome of the sent commands, field -> (value, sent at)
+        self._expected: dict[str, tuple[Any, float]] = {}
+        # fields shown along the expected ones, e.g. the position when pausing
+        self._expected_extra: dict[str, Any] = {}
+        self._expiry: asyncio.TimerHandle | None = None
+        self.rollbacks = 0
+
+        self.emit_changed_properties()
 
     def update_data(self, data):
         """Update the internals and emit PropertiesChanged for MPRIS listeners."""
-        self.data = data
-        # flatten data
-        self.entity = self.data["entity_id"]
-        self.data.update(self.data["attributes"])
-
-        _LOGGER.debug("Updating %s, emiting properties changed.", self.entity)
-        changed_attrs = {
-            "Position": self.Position,
-            "Metadata": self.Metadata,
-            "PlaybackStatus": self.PlaybackStatus,
-            "Rate": self.Rate,
-            "Shuffle": self.Shuffle,
-            "LoopStatus": self.LoopStatus,
-            "CanSeek": self.CanSeek,
-            "CanGoNext": self.CanGoNext,
-            "CanGoPrevious": self.CanGoPrevious,
+        now = time.time()
+        previous_track = self._track_key()
+        previous_position = self._current_position(now)
+
+        self._confirmed = PlayerState.from_state(data)
+        self.stale = False
+        self.entity = self._confirmed.entity_id
+        if self._expected:
+            self._reconcile()
+        self.data = self._displayed_state()
+        self._signal_seeked(previous_track, previous_position, now)
+
+        self.emit_changed_properties()
+
+    def _displayed_state(self) -> PlayerState:
+        """Return the confirmed state, with the expected changes if optimistic."""
+        if not self._expected or not self.hass_interface.optimistic:
+            return self._confirmed
+
+        changes = {field: value for field, (value, _) in self._expected.items()}
+        return self._confirmed.replace(**self._expected_extra, **changes)
+
+    def _expect(self, extra=None, **changes):
+        """Track the expected outcome of a command sent to homeassistant.
+
+        In optimistic mode, the changes are shown to the clients right away,
+        until confirmed by homeassistant. They are rolled back if the command fails,
+        or if homeassistant does not confirm them in time.
+        """
+        hass = self.hass_interface
+        sent_at = time.monotonic()
+        for field, value in changes.items():
+            self._expected[field] = (value, sent_at)
+        if extra:
+            self._expected_extra.update(extra)
+        if self._expiry is None:
+            self._expiry = asyncio.get_running_loop().call_later(
+                hass.optimistic_timeout, self._expire_expected
+            )
+
+        if hass.optimistic:
+            self.data = self._displayed_state()
+            self.emit_changed_properties()
+            hass.perceived_latency.observe(time.monotonic() - sent_at)
+
+    def _reconcile(self):
+        """Drop the expected changes confirmed by the new state."""
+        hass = self.hass_interface
+        now = time.monotonic()
+        for field, (value, sent_at) in list(self._expected.items()):
+            if not _confirms(field, value, getattr(self._confirmed, field)):
+                continue
+
+            del self._expected[field]
+            hass.confirmation_latency.observe(now - sent_at)
+            if not hass.optimistic:
+                hass.perceived_latency.observe(now - sent_at)
+
+        if not self._expected:
+            self._clear_expected()
+
+    def _expire_expected(self):
+        """Roll back the expected changes not confirmed in time."""
+        self._expiry = None
+        timeout = self.hass_interface.optimistic_timeout
+        now = time.monotonic()
+        expired = [
+            field
+            for field, (_, sent_at) in self._expected.items()
+            if now - sent_at >= timeout
+        ]
+        for field in expired:
+            _LOGGER.debug("%s: %s was not confirmed in time", self.entity, field)
+            del self._expected[field]
+
+        if self._expected:
+            oldest = min(sent_at for _, sent_at in self._expected.values())
+            self._expiry = asyncio.get_running_loop().call_later(
+                max(0.0, oldest + timeout - now), self._expire_expected
+            )
+        else:
+            self._clear_expected()
+
+        if expired:
+            self._roll_back()
+
+    def rollback_expected(self):
+        """Roll back all expected changes, used when a command fails."""
+        if not self._expected:
+            return
+
+        self._expected.clear()
+        self._clear_expected()
+        self._roll_back()
+
+    def _clear_expected(self):
+        self._expected_extra = {}
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+
+    def _roll_back(self):
+        """Show the confirmed state again."""
+        if not self.hass_interface.optimistic:
+            return
+
+        self.rollbacks += 1
+        self.data = self._displayed_state()
+        self.emit_changed_properties()
+
+    def emit_changed_properties(self):
+        """Emit PropertiesChanged for properties changed since the last emit."""
+        changed_attrs = {}
+        for prop in EMITTED_PROPERTIES:
+            value = getattr(self, prop)
+            if prop in self._emitted:
+                previous = self._emitted[prop]
+                if previous is value or previous == value:
+                    continue
+            changed_attrs[prop] = value
+
+        self.properties_suppressed += len(EMITTED_PROPERTIES) - len(changed_attrs)
+        if not changed_attrs:
+            if dbus_trace.enabled:
+                dbus_trace("Updating %s, no properties changed.", self.entity)
+            self.signals_suppressed += 1
+            return
+
+        if dbus_trace.enabled:
+            dbus_trace(
+                "Updating %s, emiting properties changed: %s",
+                self.entity,
+                list(changed_attrs),
+            )
+        self._emitted.update(changed_attrs)
+        self.properties_emitted += len(changed_attrs)
+
+        emit_latency = self.hass_interface.emit_latency
+        if emit_latency is None:
+            self.emit_properties_changed(changed_attrs)
+        else:
+            start = time.perf_counter()
+            self.emit_properties_changed(changed_attrs)
+            emit_latency.observe(time.perf_counter() - start)
+
+    def _art_cached(self):
+        """Rebuild the metadata once the album art is available."""
+        self._metadata_key = None
+        self.emit_changed_properties()
+
+    def _track_key(self):
+        """Return the identifier used to detect track changes."""
+        return self.data.media_content_id or self.data.media_title
+
+    def _current_position(self, now=None) -> float:
+        """Return the current position in seconds.
+
+        While playing, this extrapolates from the last reported position
+        using the time passed since it was updated.
+        """
+        data = self.data
+        position = data.media_position or 0
+        if data.state != "playing" or data.media_position_updated_at is None:
+            return position
+
+        if now is None:
+            now = time.time()
+        position += max(0.0, now - data.media_position_updated_at)
+
+        duration = data.media_duration
+        if duration:
+            position = min(position, duration)
+
+        return position
+
+    def _signal_seeked(self, previous_track, previous_position, now):
+        """Emit Seeked if the position is inconsistent with the elapsed time."""
+        if self.data.media_position is None:
+            return
+
+        # clients reset the position on track changes by themselves
+        if previous_track != self._track_key():
+            return
+
+        position = self._current_position(now)
+        if abs(position - previous_position) <= SEEK_TOLERANCE:
+            return
+
+        if dbus_trace.enabled:
+            dbus_trace(
+                "%s seeked from %s to %s", self.entity, previous_position, position
+            )
+        self.seeks_signaled += 1
+        self.Seeked(int(position * 1_000_000))
+
+    async def _execute(self, cmd):
+        """Execute the command, reporting failures back to the D-Bus caller."""
+        try:
+            await self.hass_interface.execute_media_player_command(cmd, self.entity)
+        except Exception as ex:
+            self.rollback_expected()
+            raise DBusError(ErrorType.FAILED, f"{cmd} failed: {ex!r}") from ex
+
+    def _expect_state(self, state):
+        """Expect the given playback state, freezing or resuming the position."""
+        now = time.time()
+        extra = {
+            "media_position": self._current_position(now),
+            "media_position_updated_at": now,
         }
-        
-        self.emit_properties_changed(changed_attrs)
+        self._expect(extra=extra, state=state)
 
     @method()
     async def Next(self):
         """Next track."""
-        await self.hass_interface.execute_media_player_command(
-            "media_next_track", self.entity
-        )
+        await self._execute("media_next_track")
 
     @method()
     async def Previous(self):
         """Previous track."""
-        await self.hass_interface.execute_media_player_command(
-            "media_previous_track", self.entity
-        )
+        await self._execute("media_previous_track")
 
     @method()
     async def Pause(self):
         """Pause."""
-        await self.hass_interface.execute_media_player_command(
-            "media_pause", self.entity
-        )
+        self._expect_state("paused")
+        await self._execute("media_pause")
 
     @method()
     async def PlayPause(self):
         """Play/pause."""
-        await self.hass_interface.execute_media_player_command(
-            "media_play_pause", self.entity
-        )
+        self._expect_state("paused" if self.data.state == "playing" else "playing")
+        await self._execute("media_play_pause")
 
     @method()
     async def Stop(self):
         """Stop playing."""
-        await self.hass_interface.execute_media_player_command(
-            "media_stop", self.entity
-        )
+        self._expect_state("idle")
+        await self._execute("media_stop")
 
     @method()
     async def Play(self):
         """Play."""
-        await self.hass_interface.execute_media_player_command(
-            "media_play", self.entity
-        )
+        self._expect_state("playing")
+        await self._execute("media_play")
 
     # Seek (x: Offset) → nothing
     # Parameters
@@ -151,7 +406,7 @@ class PlayerInterface(ServiceInterface):
     @method()
     async def Seek(self, seek_in_us: "x"):  # type: ignore
         """Seek +- given `seek_in_us`."""
-        seek_to = (self.Metadata + seek_in_us) / 1_000_000
+        seek_to = (self.Position + seek_in_us) / 1_000_000
         self.hass_interface.schedule_seek(seek_to, self.entity)
 
     # SetPosition (o: TrackId, x: Position) → nothing
@@ -195,9 +450,9 @@ class PlayerInterface(ServiceInterface):
     # When playing, the position progresses according to the rate property.
     # When paused, it remains constant.
     @signal()
-    async def Seeked(self):
+    def Seeked(self, position) -> "x":  # type: ignore
         """Signal players that the position has changed."""
-        raise NotImplementedError()
+        return position
 
     @dbus_property(access=PropertyAccess.READ)
     def PlaybackStatus(self) -> "s":  # type: ignore
@@ -205,7 +460,7 @@ class PlayerInterface(ServiceInterface):
 
         May be "Playing", "Paused" or "Stopped".
         """
-        return self.data.get("state", "").capitalize()
+        return (self.data.state or "").capitalize()
 
     # LoopStatus — s (Loop_Status)
     # Read/Write
@@ -213,7 +468,7 @@ class PlayerInterface(ServiceInterface):
     @dbus_property(access=PropertyAccess.READWRITE)
     def LoopStatus(self) -> "s":  # type: ignore
         """Return the loop status."""
-        repeat = loop_status_map[self.data.get("repeat", "off")]
+        repeat = loop_status_map[self.data.repeat]
 
         return repeat
 
@@ -222,6 +477,7 @@ class PlayerInterface(ServiceInterface):
         """Set volume."""
         reverse_loop_status_map = {v: k for k, v in loop_status_map.items()}
 
+        self._expect(repeat=reverse_loop_status_map[repeat])
         self.hass_interface.schedule_set_repeat(
             reverse_loop_status_map[repeat], self.entity
         )
@@ -242,11 +498,12 @@ class PlayerInterface(ServiceInterface):
     @dbus_property(access=PropertyAccess.READWRITE)
     def Shuffle(self) -> "b":  # type: ignore
         """Return True if shuffle is enabled."""
-        return self.data.get("shuffle", False)
+        return self.data.shuffle
 
     @Shuffle.setter
     def ShuffleSetter(self, shuffle: "b"):  # type: ignore
         """Set volume."""
+        self._expect(shuffle=shuffle)
         self.hass_interface.schedule_set_shuffle(shuffle, self.entity)
 
     # Metadata — a{sv} (Metadata_Map)
@@ -256,6 +513,19 @@ class PlayerInterface(ServiceInterface):
     @dbus_property(access=PropertyAccess.READ)
     def Metadata(self) -> "a{sv}":  # type: ignore
         """Return the metadata used by MPRIS players to display what is being played."""
+        key = tuple(getattr(self.data, attr) for attr in METADATA_ATTRIBUTES)
+        # rebuild also if the cached art got evicted, to publish a valid url
+        if key != self._metadata_key or (
+            self._art_url is not None
+            and not self.hass_interface.touch_art(self._art_url)
+        ):
+            self._metadata = self._build_metadata()
+            self._metadata_key = key
+
+        return self._metadata
+
+    def _build_metadata(self):
+        """Build the metadata dict from the current data."""
         metadata = {}
         # From the spec:
         # > The mpris:trackid attribute must always be present, and must be of D-Bus type "o".
@@ -264,17 +534,20 @@ class PlayerInterface(ServiceInterface):
         # We define this just in case some client is using it to detect track changes.
         # Valid object paths:
         #  https://dbus.freedesktop.org/doc/dbus-specification.html#message-protocol-marshaling-object-path
-        content_id = self.data.get("media_content_id")
+        content_id = self.data.media_content_id
         # not all media players expose content_id, so we fallback to title if necessary
         if not content_id:
-            content_id = self.data.get("media_title")
+            content_id = self.data.media_title
             if content_id is None:
-                _LOGGER.debug("Unable to find content id, assuming no meta data available: %s", self.data)
+                if dbus_trace.enabled:
+                    dbus_trace(
+                        "Unable to find content id, assuming no meta data available: %s",
+                        Pretty(self.data),
+                    )
                 return metadata
-        content_id = re.sub("[^0-9a-zA-Z_]", "_", content_id)
-        metadata["mpris:trackid"] = Variant("o", f"/fi/iki/tpr/hassbridge/{content_id}")
+        metadata["mpris:trackid"] = Variant("o", _track_id(content_id))
 
-        duration = self.data.get("media_duration", 0)
+        duration = self.data.media_duration or 0
         duration = int(duration) * 1_000_000
         metadata["mpris:length"] = Variant("x", duration)
 
@@ -283,19 +556,21 @@ class PlayerInterface(ServiceInterface):
             "media_title": "xesam:title",
         }
         for hass_key, xesam_key in xesam_infos.items():
-            val = self.data.get(hass_key)
+            val = getattr(self.data, hass_key)
             if val is not None:
                 metadata[xesam_key] = Variant("s", val)
 
-        artist = self.data.get("media_artist")
+        artist = self.data.media_artist
         if artist is not None:
             metadata["xesam:artist"] = Variant("as", [artist])
 
-        entity_picture = self.data.get("entity_picture")
+        entity_picture = self.data.entity_picture
+        self._art_url = None
         if entity_picture is not None:
-            metadata["mpris:artUrl"] = Variant(
-                "s", f"{self.hass_interface.http_endpoint}{entity_picture}"
+            self._art_url = self.hass_interface.art_url(
+                entity_picture, self._art_cached
             )
+            metadata["mpris:artUrl"] = Variant("s", self._art_url)
 
         return metadata
 
@@ -306,12 +581,13 @@ class PlayerInterface(ServiceInterface):
     @dbus_property(access=PropertyAccess.READWRITE)
     def Volume(self) -> "d":  # type: ignore
         """Return current volume level."""
-        vol = self.data.get("volume_level", 0)
+        vol = self.data.volume_level
         return vol
 
     @Volume.setter
     def VolumeSetter(self, vol: "d"):  # type: ignore
         """Set volume."""
+        self._expect(volume_level=vol)
         self.hass_interface.schedule_set_volume(vol, self.entity)
 
     # Position — x (Time_In_Us)
@@ -320,8 +596,8 @@ class PlayerInterface(ServiceInterface):
     # The current track position in microseconds, between 0 and the 'mpris:length' metadata entry (see Metadata).
     @dbus_property(access=PropertyAccess.READ)
     def Position(self) -> "x":  # type: ignore
-        """Return current media position."""
-        return int(self.data.get("media_position", 0) * 1_000_000)
+        """Return current media position, extrapolated while playing."""
+        return int(self._current_position() * 1_000_000)
 
     # MinimumRate — d (Playback_Rate)
     # Read only
@@ -345,7 +621,7 @@ class PlayerInterface(ServiceInterface):
     @dbus_property(access=PropertyAccess.READ)
     def CanGoNext(self) -> "b":  # type: ignore
         """We support playback controls."""
-        return bool(self.data["supported_features"] & FLAG_GONEXT)
+        return bool(self.data.supported_features & FLAG_GONEXT)
 
     # CanGoPrevious — b
     # Read only
@@ -353,7 +629,7 @@ class PlayerInterface(ServiceInterface):
     @dbus_property(access=PropertyAccess.READ)
     def CanGoPrevious(self) -> "b":  # type: ignore
         """We support playback controls."""
-        return bool(self.data["supported_features"] & FLAG_GOPREVIOUS)
+        return bool(self.data.supported_features & FLAG_GOPREVIOUS)
 
     # CanPlay — b
     # Read only
@@ -380,7 +656,7 @@ class PlayerInterface(ServiceInterface):
     @dbus_property(access=PropertyAccess.READ)
     def CanSeek(self) -> "b":  # type: ignore
         """We support playback controls."""
-        return bool(self.data["supported_features"] & FLAG_CANSEEK)
+        return bool(self.data.supported_features & FLAG_CANSEEK)
 
     # CanControl — b
     # Read only
@@ -390,3 +666,13 @@ class PlayerInterface(ServiceInterface):
     def CanControl(self) -> "b":  # type: ignore
         """We support playback controls."""
         return True
+
+
+def _confirms(field, expected, actual) -> bool:
+    """Return True if the reported value confirms the expected one."""
+    if field == "volume_level":
+        return actual is not None and abs(actual - expected) <= VOLUME_TOLERANCE
+    if field == "state" and expected == "idle":
+        # players report stopping differently
+        return actual != "playing"
+    return actual == expected
@@ -0,0 +1,84 @@
+"""Compact state of a bridged media player."""
+
+import logging
+from datetime import datetime
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class PlayerState:
+    """State of a media player, holding only the fields used for MPRIS.
+
+    Homeassistant states contain lots of data never read by the MPRIS
+    properties (contexts, source lists, group members, ...),
+    so only the used attributes are picked from the incoming state.
+    """
+
+    __slots__ = (
+        "entity_id",
+        "state",
+        "media_position",
+        "media_position_updated_at",
+        "volume_level",
+        "shuffle",
+        "repeat",
+        "supported_features",
+        "media_content_id",
+        "media_title",
+        "media_album_name",
+        "media_artist",
+        "media_duration",
+        "entity_picture",
+    )
+
+    def __init__(self, entity_id, state, attributes):
+        get = attributes.get
+        self.entity_id = entity_id
+        self.state = state
+        self.media_position = get("media_position")
+        self.media_position_updated_at = _parse_timestamp(
+            get("media_position_updated_at")
+        )
+        self.volume_level = get("volume_level", 0)
+        self.shuffle = get("shuffle", False)
+        self.repeat = get("repeat", "off")
+        self.supported_features = get("supported_features", 0)
+        self.media_content_id = get("media_content_id")
+        self.media_title = get("media_title")
+        self.media_album_name = get("media_album_name")
+        self.media_artist = get("media_artist")
+        self.media_duration = get("media_duration")
+        self.entity_picture = get("entity_picture")
+
+    @classmethod
+    def from_state(cls, state) -> "PlayerState":
+        """Create from a homeassistant state dict."""
+        return cls(state["entity_id"], state["state"], state["attributes"])
+
+    def replace(self, **changes) -> "PlayerState":
+        """Return a copy with the given fields changed."""
+        copy = PlayerState.__new__(PlayerState)
+        for name in self.__slots__:
+            setattr(
+                copy, name, changes[name] if name in changes else getattr(self, name)
+            )
+        return copy
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"<PlayerState {fields}>"
+
+
+def _parse_timestamp(value):
+    """Convert a homeassistant timestamp to seconds since epoch."""
+    if not value:
+        return None
+
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        _LOGGER.warning("Unable to parse timestamp: %s", value)
+        return None
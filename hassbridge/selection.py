@@ -0,0 +1,135 @@
+"""Rules deciding which media players get bridged."""
+
+import fnmatch
+import logging
+import re
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _compile_globs(patterns):
+    """Compile the entity id globs into a single regex, or None if there are none."""
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(pattern) for pattern in patterns))
+
+
+def _compile_predicate(predicate):
+    """Compile `key`, `key=value` or `key!=value` to a function on attributes."""
+    if "!=" in predicate:
+        key, _, value = predicate.partition("!=")
+        return lambda attributes: str(attributes.get(key)) != value
+    if "=" in predicate:
+        key, _, value = predicate.partition("=")
+        return lambda attributes: str(attributes.get(key)) == value
+    return lambda attributes: attributes.get(predicate) is not None
+
+
+class EntitySelector:
+    """Include and exclude rules for the media players to bridge.
+
+    Entity id globs and areas are static for an entity, so they are evaluated
+    once per entity id into an index, and each incoming event is classified
+    with a single lookup. Device classes and attribute predicates depend on
+    the state, and are checked only for the media players passing the index.
+
+    Areas can be given using their id or name, and require the registries
+    to be loaded using `update_registry`.
+    """
+
+    def __init__(
+        self, include=(), exclude=(), areas=(), device_classes=(), attributes=()
+    ):
+        self._include = _compile_globs(include)
+        self._exclude = _compile_globs(exclude)
+        self._areas = set(areas)
+        self._device_classes = set(device_classes)
+        self._attributes = [_compile_predicate(p) for p in attributes]
+        self._state_rules = bool(self._device_classes or self._attributes)
+
+        # entity id -> (area id, area name)
+        self._entity_areas = {}
+        # entity ids of the media players in the entity registry
+        self._registry_players = None
+        # entity id -> whether it passes the id and area rules
+        self._index = {}
+
+    @property
+    def filters_ids(self) -> bool:
+        """Return True if the rules can limit the subscribed entity ids."""
+        return self._include is not None or self._exclude is not None or self.uses_areas
+
+    @property
+    def uses_areas(self) -> bool:
+        """Return True if the area and device registries are needed."""
+        return bool(self._areas)
+
+    def update_registry(self, entities, devices=(), areas=()):
+        """Update the entity areas from the registry lists, resetting the index."""
+        area_names = {area["area_id"]: area["name"] for area in areas}
+        device_areas = {device["id"]: device.get("area_id") for device in devices}
+
+        self._entity_areas = {}
+        self._registry_players = []
+        for entity in entities:
+            entity_id = entity["entity_id"]
+            if not entity_id.startswith("media_player."):
+                continue
+            self._registry_players.append(entity_id)
+            area_id = entity.get("area_id") or device_areas.get(entity.get("device_id"))
+            if area_id is not None:
+                self._entity_areas[entity_id] = (area_id, area_names.get(area_id))
+
+        self._index = {}
+
+    def matches_id(self, entity_id) -> bool:
+        """Return True if the entity passes the id and area rules."""
+        try:
+            return self._index[entity_id]
+        except KeyError:
+            result = self._index[entity_id] = self._match_id(entity_id)
+            return result
+
+    def _match_id(self, entity_id) -> bool:
+        if not entity_id.startswith("media_player."):
+            return False
+        if self._include is not None and not self._include.match(entity_id):
+            return False
+        if self._exclude is not None and self._exclude.match(entity_id):
+            return False
+        if self._areas:
+            area = self._entity_areas.get(entity_id, ())
+            if not self._areas.intersection(area):
+                return False
+        return True
+
+    def matches(self, entity_id, state) -> bool:
+        """Return True if the entity in the given state should be bridged."""
+        if not self.matches_id(entity_id):
+            return False
+        if not self._state_rules:
+            return True
+
+        attributes = state["attributes"]
+        if (
+            self._device_classes
+            and attributes.get("device_class") not in self._device_classes
+        ):
+            return False
+        return all(predicate(attributes) for predicate in self._attributes)
+
+    def subscription_filter(self):
+        """Return the registered media players passing the index, or None for all.
+
+        Entities missing from the registry (i.e., without an unique id)
+        or added after loading it are not included.
+        """
+        if not self.filters_ids or self._registry_players is None:
+            return None
+
+        entity_ids = [e for e in self._registry_players if self.matches_id(e)]
+        if not entity_ids:
+            _LOGGER.warning("No registered media players match, subscribing to all")
+            return None
+
+        return entity_ids
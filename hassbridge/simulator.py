@@ -0,0 +1,414 @@
+"""Simulated homeassistant websocket API for load and soak testing the bridge.
+
+This implements the subset of the websocket API used by the bridge
+(auth, supported_features, ping, subscribe_events, subscribe_entities,
+get_states, call_service and the entity, device and area registry listings) on top of an in-memory
+installation with a configurable number of media players and background entities.
+The players are spread over the areas in `AREAS`, each player having a device of its own.
+Service calls for media players change their state like a real player would,
+informing the subscribers about the change.
+"""
+
+import asyncio
+import contextlib
+import logging
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+
+import websockets
+
+from .codec import get_codec
+
+_LOGGER = logging.getLogger(__name__)
+
+AREAS = {"living_room": "Living room", "kitchen": "Kitchen", "office": "Office"}
+
+
+def _now_iso(timestamp) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+class _Connection:
+    """Client connection and its subscriptions."""
+
+    def __init__(self, ws):
+        self.ws = ws
+        # subscription id -> (kind, entity ids or None for all)
+        self.subscriptions = {}
+        # send the messages queued up meanwhile in a single frame
+        self.coalesce = False
+        self.outgoing = []
+        # silently dropped connection, nothing gets sent or handled
+        self.stalled = False
+
+
+class Simulator:
+    """Simulated homeassistant instance."""
+
+    def __init__(
+        self,
+        players=5,
+        entities=1000,
+        rate=10.0,
+        latency=0.0,
+        disconnect_every=None,
+        stall_every=None,
+        token=None,
+        seed=None,
+    ):
+        self.rate = rate
+        self.latency = latency
+        self.disconnect_every = disconnect_every
+        self.stall_every = stall_every
+        self.token = token
+        self._rnd = random.Random(seed)  # noqa: S311
+        self._codec = get_codec()
+        self._connections = set()
+
+        self.states = {}
+        self.devices = {}
+        now = time.time()
+        for i in range(entities):
+            entity_id = f"sensor.simulated_{i}"
+            self.states[entity_id] = self._state(
+                entity_id, "0", {"unit_of_measurement": "W"}, now
+            )
+        for i in range(players):
+            entity_id = f"media_player.simulated_{i}"
+            attributes = {
+                "friendly_name": f"Simulated player {i}",
+                "volume_level": 0.5,
+                "is_volume_muted": False,
+                "media_content_id": f"simulated:track:{i}",
+                "media_content_type": "music",
+                "media_title": f"Track {i}",
+                "media_artist": f"Artist {i}",
+                "media_album_name": f"Album {i}",
+                "media_duration": 240,
+                "media_position": 0,
+                "media_position_updated_at": _now_iso(now),
+                "shuffle": False,
+                "repeat": "off",
+                "supported_features": 4127295,
+            }
+            self.states[entity_id] = self._state(entity_id, "playing", attributes, now)
+            self.devices[entity_id] = {
+                "id": f"simulated_device_{i}",
+                "area_id": list(AREAS)[i % len(AREAS)],
+            }
+
+        self.events_sent = 0
+        self.frames_sent = 0
+        self.service_calls = 0
+        self.disconnects = 0
+        self.stalls = 0
+
+    @staticmethod
+    def _state(entity_id, state, attributes, timestamp):
+        return {
+            "entity_id": entity_id,
+            "state": state,
+            "attributes": attributes,
+            "last_changed": _now_iso(timestamp),
+            "last_updated": _now_iso(timestamp),
+            "context": {"id": uuid.uuid4().hex, "parent_id": None, "user_id": None},
+        }
+
+    async def serve(self, host="127.0.0.1", port=8123):
+        """Serve the websocket API until cancelled."""
+        async with websockets.serve(self._handle, host, port):
+            _LOGGER.info(
+                "Simulating %s entities on ws://%s:%s/api/websocket",
+                len(self.states),
+                host,
+                port,
+            )
+            tasks = [asyncio.ensure_future(self._generate_events())]
+            tasks.append(asyncio.ensure_future(self._report()))
+            try:
+                await asyncio.Future()
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    async def _send(self, conn, msg):
+        if conn.stalled:
+            return
+
+        frame = self._codec.dumps(msg)
+        if conn.coalesce:
+            # like homeassistant, join the messages queued until the next iteration
+            conn.outgoing.append(frame)
+            if len(conn.outgoing) > 1:
+                return
+            await asyncio.sleep(0)
+            frames, conn.outgoing = conn.outgoing, []
+            frame = frames[0] if len(frames) == 1 else "[" + ",".join(frames) + "]"
+
+        self.frames_sent += 1
+        with contextlib.suppress(websockets.ConnectionClosed):
+            await conn.ws.send(frame)
+
+    async def _respond(self, conn, msg):
+        """Send the response, delayed by the configured latency."""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        await self._send(conn, msg)
+
+    async def _handle(self, ws, *args):
+        conn = _Connection(ws)
+        await ws.send(self._codec.dumps({"type": "auth_required", "ha_version": "sim"}))
+        auth = self._codec.loads(await ws.recv())
+        if self.token is not None and auth.get("access_token") != self.token:
+            await ws.send(
+                self._codec.dumps({"type": "auth_invalid", "message": "Invalid token"})
+            )
+            return
+        await ws.send(self._codec.dumps({"type": "auth_ok", "ha_version": "sim"}))
+
+        loop = asyncio.get_running_loop()
+        timers = []
+        if self.disconnect_every:
+            timers.append(
+                loop.call_later(
+                    self.disconnect_every * self._rnd.uniform(0.5, 1.5),
+                    self._disconnect,
+                    ws,
+                )
+            )
+        if self.stall_every:
+            timers.append(
+                loop.call_later(
+                    self.stall_every * self._rnd.uniform(0.5, 1.5), self._stall, conn
+                )
+            )
+
+        self._connections.add(conn)
+        try:
+            async for frame in ws:
+                if conn.stalled:
+                    continue
+                msg = self._codec.loads(frame)
+                asyncio.ensure_future(self._handle_message(conn, msg))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._connections.discard(conn)
+            for timer in timers:
+                timer.cancel()
+
+    def _disconnect(self, ws):
+        _LOGGER.info("Forcing a disconnect")
+        self.disconnects += 1
+        asyncio.ensure_future(ws.close())
+
+    def _stall(self, conn):
+        _LOGGER.info("Stalling a connection")
+        self.stalls += 1
+        conn.stalled = True
+
+    async def _handle_message(self, conn, msg):
+        msg_id = msg.get("id")
+        msg_type = msg.get("type")
+        result = None
+
+        if msg_type == "ping":
+            await self._respond(conn, {"id": msg_id, "type": "pong"})
+            return
+        elif msg_type == "supported_features":
+            conn.coalesce = bool(msg.get("features", {}).get("coalesce_messages"))
+        elif msg_type == "subscribe_events":
+            conn.subscriptions[msg_id] = ("events", None)
+        elif msg_type == "subscribe_entities":
+            entity_ids = msg.get("entity_ids")
+            conn.subscriptions[msg_id] = (
+                "entities",
+                set(entity_ids) if entity_ids else None,
+            )
+        elif msg_type == "get_states":
+            result = list(self.states.values())
+        elif msg_type == "config/entity_registry/list":
+            result = [
+                {
+                    "entity_id": entity_id,
+                    "device_id": self.devices[entity_id]["id"]
+                    if entity_id in self.devices
+                    else None,
+                    "area_id": None,
+                }
+                for entity_id in self.states
+            ]
+        elif msg_type == "config/device_registry/list":
+            result = list(self.devices.values())
+        elif msg_type == "config/area_registry/list":
+            result = [
+                {"area_id": area_id, "name": name} for area_id, name in AREAS.items()
+            ]
+        elif msg_type == "call_service":
+            self.service_calls += 1
+            result = {"context": {"id": uuid.uuid4().hex}}
+        else:
+            await self._respond(
+                conn,
+                {
+                    "id": msg_id,
+                    "type": "result",
+                    "success": False,
+                    "error": {"code": "unknown_command", "message": "Unknown command."},
+                },
+            )
+            return
+
+        await self._respond(
+            conn, {"id": msg_id, "type": "result", "success": True, "result": result}
+        )
+
+        if msg_type == "subscribe_entities":
+            await self._send_initial_entities(conn, msg_id)
+        elif msg_type == "call_service" and msg.get("domain") == "media_player":
+            self._call_media_player_service(msg["service"], msg["service_data"])
+
+    async def _send_initial_entities(self, conn, subscription_id):
+        _, entity_ids = conn.subscriptions[subscription_id]
+        added = {}
+        for entity_id, state in self.states.items():
+            if entity_ids is not None and entity_id not in entity_ids:
+                continue
+            added[entity_id] = {
+                "s": state["state"],
+                "a": state["attributes"],
+                "c": state["context"]["id"],
+                "lc": datetime.fromisoformat(state["last_changed"]).timestamp(),
+            }
+        await self._send(
+            conn, {"id": subscription_id, "type": "event", "event": {"a": added}}
+        )
+
+    def _call_media_player_service(self, service, data):
+        entity_id = data.get("entity_id")
+        old = self.states.get(entity_id)
+        if old is None:
+            return
+
+        state = old["state"]
+        attributes = dict(old["attributes"])
+        now = time.time()
+        if service in ("media_play", "media_pause", "media_play_pause"):
+            attributes["media_position"] = self._position(old, now)
+            attributes["media_position_updated_at"] = _now_iso(now)
+            if service == "media_play_pause":
+                state = "paused" if state == "playing" else "playing"
+            else:
+                state = "playing" if service == "media_play" else "paused"
+        elif service == "media_stop":
+            state = "idle"
+        elif service in ("media_next_track", "media_previous_track"):
+            track = int(attributes["media_content_id"].rsplit(":", 1)[1])
+            track += 1 if service == "media_next_track" else -1
+            attributes.update(
+                {
+                    "media_content_id": f"simulated:track:{track}",
+                    "media_title": f"Track {track}",
+                    "media_position": 0,
+                    "media_position_updated_at": _now_iso(now),
+                }
+            )
+        elif service == "volume_set":
+            attributes["volume_level"] = data["volume_level"]
+        elif service == "shuffle_set":
+            attributes["shuffle"] = data["shuffle"]
+        elif service == "repeat_set":
+            attributes["repeat"] = data["repeat"]
+        elif service == "media_seek":
+            attributes["media_position"] = data["seek_position"]
+            attributes["media_position_updated_at"] = _now_iso(now)
+        else:
+            _LOGGER.debug("Ignoring unsupported service %s", service)
+            return
+
+        self._set_state(entity_id, state, attributes, now)
+
+    @staticmethod
+    def _position(state, now):
+        attributes = state["attributes"]
+        position = attributes.get("media_position", 0)
+        if state["state"] == "playing":
+            updated_at = datetime.fromisoformat(attributes["media_position_updated_at"])
+            position += now - updated_at.timestamp()
+        return min(position, attributes.get("media_duration", position))
+
+    def _set_state(self, entity_id, state, attributes, now):
+        """Change the state and inform the subscribers."""
+        old = self.states[entity_id]
+        new = self._state(entity_id, state, attributes, now)
+        if state == old["state"]:
+            new["last_changed"] = old["last_changed"]
+        self.states[entity_id] = new
+
+        event = {
+            "event_type": "state_changed",
+            "data": {"entity_id": entity_id, "old_state": old, "new_state": new},
+            "origin": "LOCAL",
+            "time_fired": new["last_updated"],
+            "context": new["context"],
+        }
+        additions = {"c": new["context"]["id"], "lu": now}
+        if state != old["state"]:
+            additions["s"] = state
+        changed = {
+            key: value
+            for key, value in attributes.items()
+            if old["attributes"].get(key) != value
+        }
+        if changed:
+            additions["a"] = changed
+        diff = {"c": {entity_id: {"+": additions}}}
+
+        for conn in list(self._connections):
+            for subscription_id, (kind, entity_ids) in conn.subscriptions.items():
+                if kind == "events":
+                    msg_event = event
+                elif entity_ids is None or entity_id in entity_ids:
+                    msg_event = diff
+                else:
+                    continue
+                self.events_sent += 1
+                asyncio.ensure_future(
+                    self._send(
+                        conn,
+                        {"id": subscription_id, "type": "event", "event": msg_event},
+                    )
+                )
+
+    async def _generate_events(self):
+        """Change background entities at the configured rate."""
+        sensors = [e for e in self.states if not e.startswith("media_player.")]
+        if not self.rate or not sensors:
+            return
+
+        while True:
+            await asyncio.sleep(1 / self.rate)
+            entity_id = self._rnd.choice(sensors)
+            old = self.states[entity_id]
+            self._set_state(
+                entity_id,
+                str(self._rnd.randint(0, 3000)),
+                old["attributes"],
+                time.time(),
+            )
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(60)
+            _LOGGER.info(
+                "%s connections, %s events sent in %s frames, %s service calls, "
+                "%s forced disconnects, %s stalls",
+                len(self._connections),
+                self.events_sent,
+                self.frames_sent,
+                self.service_calls,
+                self.disconnects,
+                self.stalls,
+            )
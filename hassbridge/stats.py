@@ -0,0 +1,137 @@
+"""Statistics helpers."""
+
+import logging
+import time
+from bisect import bisect_left
+from collections import deque
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Histogram:
+    """Histogram with fixed buckets, values are in seconds."""
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # the last one is for values over the largest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Add a value to the histogram."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, percent) -> float:
+        """Return the upper bound of the bucket containing the given percentile."""
+        if not self.count:
+            return 0.0
+
+        target = self.count * percent / 100
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+
+        return float("inf")
+
+    def __repr__(self):
+        return (
+            f"<Histogram count={self.count} sum={self.sum:.3f}"
+            f" p50={self.percentile(50)} p99={self.percentile(99)}>"
+        )
+
+
+class RollingWindow:
+    """The latest values of a measurement, for statistics over a rolling window."""
+
+    __slots__ = ("_values",)
+
+    def __init__(self, size=10):
+        self._values = deque(maxlen=size)
+
+    def observe(self, value):
+        """Add a value, dropping the oldest one if the window is full."""
+        self._values.append(value)
+
+    @property
+    def last(self) -> float:
+        """Return the latest value, or 0 if there are none."""
+        return self._values[-1] if self._values else 0.0
+
+    @property
+    def mean(self) -> float:
+        """Return the mean of the values in the window, or 0 if there are none."""
+        return sum(self._values) / len(self._values) if self._values else 0.0
+
+    @property
+    def max(self) -> float:
+        """Return the largest value in the window, or 0 if there are none."""
+        return max(self._values, default=0.0)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return (
+            f"<RollingWindow count={len(self)} last={self.last:.3f}"
+            f" mean={self.mean:.3f} max={self.max:.3f}>"
+        )
+
+
+class StartupTimer:
+    """Time taken by each phase of the startup, until the players are exported.
+
+    Each phase is measured from the end of the previous one,
+    and only its first completion is recorded, so reconnects are ignored.
+    The timings are logged once the last phase completes.
+    """
+
+    PHASES = ("import", "connect", "auth", "initial_state", "bus_export")
+
+    def __init__(self, started=None, name=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.name = name
+        self.durations = {}
+        self._last = self.started
+
+    @property
+    def done(self) -> bool:
+        """Return True if all phases have completed."""
+        return len(self.durations) == len(self.PHASES)
+
+    @property
+    def total(self) -> float:
+        """Return the time taken by the completed phases."""
+        return self._last - self.started
+
+    def mark(self, phase):
+        """Record the completion of the given phase."""
+        if phase in self.durations:
+            return
+
+        now = time.perf_counter()
+        self.durations[phase] = now - self._last
+        self._last = now
+        if self.done:
+            self.report()
+
+    def report(self):
+        """Log the phase timings."""
+        phases = ", ".join(
+            f"{phase} {duration * 1000:.1f} ms"
+            for phase, duration in self.durations.items()
+        )
+        _LOGGER.info(
+            "Startup%s: %s, total %.1f ms",
+            f" of {self.name}" if self.name else "",
+            phases,
+            self.total * 1000,
+        )
@@ -0,0 +1,61 @@
+"""Debug tracing for the hot paths, toggleable per subsystem.
+
+Callers check the `enabled` attribute before tracing, so the disabled path costs
+a single attribute lookup, and expensive payloads are wrapped in `Pretty`
+to render them only when the record is actually emitted::
+
+    if dispatch_trace.enabled:
+        dispatch_trace("got new state: %s", Pretty(attrs))
+"""
+
+import logging
+from pprint import pformat
+
+
+class Tracer:
+    """Tracer for a single subsystem, logging to hassbridge.trace.<name>."""
+
+    __slots__ = ("name", "enabled", "_logger")
+
+    def __init__(self, name):
+        self.name = name
+        self.enabled = False
+        self._logger = logging.getLogger(f"hassbridge.trace.{name}")
+
+    def __call__(self, msg, *args):
+        """Log the message, check `enabled` first to skip formatting the call."""
+        self._logger.debug(msg, *args)
+
+    def __repr__(self):
+        return f"<Tracer {self.name} enabled={self.enabled}>"
+
+
+class Pretty:
+    """Pretty-print the wrapped object only when converted to a string."""
+
+    __slots__ = ("obj",)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return pformat(self.obj)
+
+
+ws_trace = Tracer("ws")
+dispatch_trace = Tracer("dispatch")
+dbus_trace = Tracer("dbus")
+commands_trace = Tracer("commands")
+
+TRACERS = {
+    tracer.name: tracer
+    for tracer in [ws_trace, dispatch_trace, dbus_trace, commands_trace]
+}
+
+
+def configure_tracing(subsystems):
+    """Enable tracing for the given subsystems, and disable it for the rest."""
+    for name, tracer in TRACERS.items():
+        tracer.enabled = name in subsystems
+        if tracer.enabled:
+            tracer._logger.setLevel(logging.DEBUG)
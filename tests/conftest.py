@@ -0,0 +1,7 @@
+"""Shared test setup."""
+
+import sys
+from pathlib import Path
+
+# the in-memory stand-ins and startup checks of the benchmarks are used by the tests
+sys.path.insert(0, str(Path(__file__).parent.parent / "benchmarks"))
@@ -0,0 +1,86 @@
+"""Tests for the coalescing update queue."""
+
+import asyncio
+
+import pytest
+
+from hassbridge.coalescing import CoalescingQueue
+
+
+async def drain(queue):
+    return [await queue.get() for _ in range(len(queue))]
+
+
+@pytest.mark.asyncio
+async def test_latest_value_wins_in_place():
+    queue = CoalescingQueue()
+    await queue.put("a", 1)
+    await queue.put("b", 1)
+    await queue.put("a", 2)
+
+    assert queue.merged == 1
+    assert await drain(queue) == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_barrier_keeps_ordering():
+    queue = CoalescingQueue()
+    await queue.put("a", "a1")
+    await queue.put(None, "barrier")
+    await queue.put("a", "a2")
+    await queue.put("a", "a3")
+
+    # a2 is not merged into a1 queued before the barrier
+    assert await drain(queue) == ["a1", "barrier", "a3"]
+    assert queue.merged == 1
+
+
+@pytest.mark.asyncio
+async def test_barriers_are_never_merged():
+    queue = CoalescingQueue()
+    await queue.put(None, 1)
+    await queue.put(None, 2)
+
+    assert await drain(queue) == [1, 2]
+    assert queue.merged == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue():
+    queue = CoalescingQueue(maxsize=2)
+    await queue.put("a", 1)
+    await queue.put("b", 1)
+
+    # merging does not need space
+    await asyncio.wait_for(queue.put("a", 2), 1)
+
+    put = asyncio.ensure_future(queue.put("c", 1))
+    await asyncio.sleep(0)
+    assert not put.done()
+
+    assert await queue.get() == 2
+    await asyncio.wait_for(put, 1)
+    assert await drain(queue) == [1, 1]
+    assert queue.max_depth == 2
+
+
+@pytest.mark.asyncio
+async def test_get_waits():
+    queue = CoalescingQueue()
+    get = asyncio.ensure_future(queue.get())
+    await asyncio.sleep(0)
+    assert not get.done()
+
+    await queue.put("a", 1)
+    assert await asyncio.wait_for(get, 1) == 1
+
+
+@pytest.mark.asyncio
+async def test_clear():
+    queue = CoalescingQueue(maxsize=1)
+    await queue.put("a", 1)
+    queue.clear()
+
+    assert len(queue) == 0
+    await asyncio.wait_for(queue.put("b", 2), 1)
+    assert await queue.get() == 2
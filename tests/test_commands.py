@@ -0,0 +1,54 @@
+"""Tests for coalescing the commands sent to homeassistant."""
+
+import asyncio
+
+import pytest
+
+from hassbridge.hassinterface import HassError, HassInterface
+
+
+def hass_with_calls(fail=()):
+    """Return a HassInterface recording the sent volumes, failing the given ones."""
+    hass = HassInterface("http://localhost:8123", "token", command_interval=0.01)
+    calls = []
+
+    async def execute_media_player_command(cmd, entity, params=None):
+        calls.append(params["volume_level"])
+        # let the caller give new values while the command is in flight
+        await asyncio.sleep(0.005)
+        if params["volume_level"] in fail:
+            raise HassError("failed")
+
+    hass.execute_media_player_command = execute_media_player_command
+    return hass, calls
+
+
+async def wait_until_sent(hass):
+    while hass._coalescer_tasks:
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_latest_value_is_sent():
+    hass, calls = hass_with_calls()
+
+    for volume in (0.1, 0.2, 0.3):
+        hass.schedule_set_volume(volume, "media_player.kitchen")
+        await asyncio.sleep(0)
+    await wait_until_sent(hass)
+
+    assert calls == [0.1, 0.3]
+    assert hass.commands_coalesced == 1
+
+
+@pytest.mark.asyncio
+async def test_latest_value_is_sent_after_failure():
+    hass, calls = hass_with_calls(fail={0.1})
+
+    hass.schedule_set_volume(0.1, "media_player.kitchen")
+    await asyncio.sleep(0)
+    hass.schedule_set_volume(0.5, "media_player.kitchen")
+    await wait_until_sent(hass)
+
+    assert calls == [0.1, 0.5]
+    assert not hass._coalesced
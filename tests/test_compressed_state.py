@@ -0,0 +1,129 @@
+"""Tests for the compressed subscribe_entities format."""
+
+import pytest
+
+from hassbridge.hassinterface import (
+    HassInterface,
+    _apply_compressed_diff,
+    _expand_compressed_state,
+)
+
+COMPRESSED = {
+    "s": "playing",
+    "a": {"volume_level": 0.5, "media_title": "Track 1"},
+    "c": "01ctx",
+    "lc": 1700000000.0,
+}
+
+
+def test_expand_compressed_state():
+    state = _expand_compressed_state("media_player.kitchen", COMPRESSED)
+
+    assert state == {
+        "entity_id": "media_player.kitchen",
+        "state": "playing",
+        "attributes": {"volume_level": 0.5, "media_title": "Track 1"},
+        "context": {"id": "01ctx"},
+        "last_changed": 1700000000.0,
+        "last_updated": 1700000000.0,
+    }
+    # the attributes are not shared with the compressed state
+    state["attributes"]["volume_level"] = 1
+    assert COMPRESSED["a"]["volume_level"] == 0.5
+
+
+def test_expand_compressed_state_full_context():
+    context = {"id": "01ctx", "parent_id": None, "user_id": "user"}
+    compressed = {"s": "off", "c": context, "lc": 1.0, "lu": 2.0}
+
+    state = _expand_compressed_state("media_player.kitchen", compressed)
+
+    assert state["attributes"] == {}
+    assert state["context"] == context
+    assert state["last_changed"] == 1.0
+    assert state["last_updated"] == 2.0
+
+
+def test_apply_diff_additions():
+    state = _expand_compressed_state("media_player.kitchen", COMPRESSED)
+    attributes = state["attributes"]
+
+    _apply_compressed_diff(
+        state, {"+": {"s": "paused", "a": {"volume_level": 0.2}, "c": "02ctx"}}
+    )
+
+    assert state["state"] == "paused"
+    assert state["attributes"] == {"volume_level": 0.2, "media_title": "Track 1"}
+    assert state["context"] == {"id": "02ctx"}
+    # the previous attributes are left untouched, as they may have been handed out
+    assert attributes["volume_level"] == 0.5
+
+
+def test_apply_diff_timestamps():
+    state = _expand_compressed_state("media_player.kitchen", COMPRESSED)
+
+    _apply_compressed_diff(state, {"+": {"lu": 5.0}})
+    assert state["last_changed"] == 1700000000.0
+    assert state["last_updated"] == 5.0
+
+    _apply_compressed_diff(state, {"+": {"lc": 6.0}})
+    assert state["last_changed"] == 6.0
+    assert state["last_updated"] == 6.0
+
+
+def test_apply_diff_removals():
+    state = _expand_compressed_state("media_player.kitchen", COMPRESSED)
+
+    _apply_compressed_diff(state, {"-": {"a": ["media_title", "missing"]}})
+
+    assert state["attributes"] == {"volume_level": 0.5}
+
+
+@pytest.mark.asyncio
+async def test_handle_entities_event():
+    hass = HassInterface("http://localhost:8123", "token", subscription="entities")
+    initial, updates = [], []
+
+    async def handle_get_states_result(states):
+        initial.append(states)
+
+    async def update_player(entity_id, state):
+        updates.append(state)
+
+    hass.handle_get_states_result = handle_get_states_result
+    hass.update_player = update_player
+
+    await hass.handle_entities_event(
+        {"event": {"a": {"media_player.kitchen": COMPRESSED}}}
+    )
+    assert [s["entity_id"] for s in initial[0]] == ["media_player.kitchen"]
+    assert updates == []
+
+    await hass.handle_entities_event(
+        {"event": {"c": {"media_player.kitchen": {"+": {"s": "paused"}}}}}
+    )
+    assert updates[-1]["state"] == "paused"
+    assert updates[-1]["attributes"]["media_title"] == "Track 1"
+
+    # diffs of unknown entities are ignored
+    await hass.handle_entities_event(
+        {"event": {"c": {"media_player.unknown": {"+": {"s": "paused"}}}}}
+    )
+    assert len(updates) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("event", [{"a": {}}, {}])
+async def test_handle_empty_initial_entities_event(event):
+    hass = HassInterface("http://localhost:8123", "token", subscription="entities")
+    initial = []
+
+    async def handle_get_states_result(states):
+        initial.append(states)
+
+    hass.handle_get_states_result = handle_get_states_result
+
+    await hass.handle_entities_event({"event": event})
+
+    # still the full snapshot, removing the players gone meanwhile
+    assert initial == [[]]
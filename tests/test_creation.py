@@ -0,0 +1,113 @@
+"""Tests for creating the players in the background."""
+
+import asyncio
+
+import pytest
+from fakes import FakeWebsocket, fake_bus_pool
+
+from hassbridge.hassinterface import HassInterface
+
+KITCHEN = "media_player.kitchen"
+OFFICE = "media_player.office"
+
+# seconds taken by each D-Bus call, i.e. connecting and requesting the name
+BUS_LATENCY = 0.05
+
+
+def state(entity_id, volume=0.5, title="Track"):
+    return {
+        "entity_id": entity_id,
+        "state": "playing",
+        "attributes": {"volume_level": volume, "media_title": title},
+        "context": {"id": f"{entity_id}-{volume}-{title}"},
+    }
+
+
+def slow_hass():
+    """Return a hass interface taking a while to create the players."""
+    bus_pool, stats = fake_bus_pool(BUS_LATENCY)
+    hass = HassInterface("http://localhost:8123", "token", bus_pool=bus_pool)
+    hass.ws = FakeWebsocket()
+    return hass, stats
+
+
+@pytest.mark.asyncio
+async def test_updates_while_creating():
+    hass, stats = slow_hass()
+
+    await hass.update_player(KITCHEN, state(KITCHEN))
+    assert KITCHEN not in hass._players
+    await hass.update_player(KITCHEN, state(KITCHEN, volume=0.6))
+    await hass.update_player(KITCHEN, state(KITCHEN, volume=0.7, title="Next"))
+    await hass.wait_for_players()
+
+    # the latest update is applied once the player is ready
+    player = hass._players[KITCHEN]
+    assert player.Volume == 0.7
+    assert player.Metadata["xesam:title"].value == "Next"
+    assert hass._bus_pool.connections_opened == 1
+    assert stats.names == 1
+
+    await hass.update_player(KITCHEN, state(KITCHEN, volume=0.8))
+    assert player.Volume == 0.8
+
+
+@pytest.mark.asyncio
+async def test_creation_does_not_block():
+    hass, stats = slow_hass()
+    loop = asyncio.get_running_loop()
+
+    started = loop.time()
+    await hass.update_player(KITCHEN, state(KITCHEN))
+    await hass.update_player(OFFICE, state(OFFICE))
+    assert loop.time() - started < BUS_LATENCY
+
+    await hass.wait_for_players()
+    assert sorted(hass._players) == [KITCHEN, OFFICE]
+    # created concurrently, connecting and requesting the names take two calls
+    assert loop.time() - started < 4 * BUS_LATENCY
+
+
+@pytest.mark.asyncio
+async def test_removed_while_creating():
+    hass, stats = slow_hass()
+
+    await hass.update_player(KITCHEN, state(KITCHEN))
+    # while connecting to the bus
+    await asyncio.sleep(BUS_LATENCY / 2)
+    await hass.remove_player(KITCHEN)
+    await hass.wait_for_players()
+
+    assert KITCHEN not in hass._players
+    assert stats.names == 0
+    # the connection is kept for the next player
+    assert hass._bus_pool.open_connections == 1
+    assert not hass._bus_pool._in_use
+
+
+@pytest.mark.asyncio
+async def test_readded_while_creating():
+    hass, stats = slow_hass()
+
+    await hass.update_player(KITCHEN, state(KITCHEN))
+    await asyncio.sleep(BUS_LATENCY / 2)
+    await hass.remove_player(KITCHEN)
+    await hass.update_player(KITCHEN, state(KITCHEN, volume=0.6))
+    await hass.wait_for_players()
+
+    assert hass._players[KITCHEN].Volume == 0.6
+    assert hass._bus_pool.connections_opened == 1
+    assert stats.names == 1
+
+
+@pytest.mark.asyncio
+async def test_removed_before_creating():
+    hass, stats = slow_hass()
+
+    await hass.update_player(KITCHEN, state(KITCHEN))
+    await hass.remove_player(KITCHEN)
+    await hass.wait_for_players()
+
+    assert KITCHEN not in hass._players
+    # nothing was connected for it
+    assert hass._bus_pool.connections_opened == 0
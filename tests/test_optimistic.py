@@ -0,0 +1,137 @@
+"""Tests for the optimistic updates of player commands."""
+
+import asyncio
+import itertools
+
+import pytest
+from dbus_next import DBusError
+from fakes import FakeWebsocket, fake_bus_pool
+
+from hassbridge.hassinterface import HassError, HassInterface
+
+ENTITY = "media_player.kitchen"
+
+_contexts = itertools.count()
+
+
+def state(state="playing", **attributes):
+    return {
+        "entity_id": ENTITY,
+        "state": state,
+        "attributes": {"volume_level": 0.5, "media_title": "Track", **attributes},
+        "context": {"id": f"{next(_contexts):032x}"},
+    }
+
+
+async def bridged_player(fail=False, **kwargs):
+    """Return the hass interface, its bridged player and the bus stats."""
+    bus_pool, stats = fake_bus_pool()
+    kwargs.setdefault("optimistic", True)
+    hass = HassInterface("http://localhost:8123", "token", bus_pool=bus_pool, **kwargs)
+    hass.ws = FakeWebsocket()
+
+    async def execute_media_player_command(cmd, entity, params=None):
+        if fail:
+            raise HassError("failed")
+
+    hass.execute_media_player_command = execute_media_player_command
+    await hass.update_player(ENTITY, state())
+    await hass.wait_for_players()
+    return hass, hass._players[ENTITY], stats
+
+
+async def pause(player):
+    """Call the Pause method like a D-Bus client, which discards the coroutine."""
+    await type(player).Pause.__wrapped__(player)
+
+
+@pytest.mark.asyncio
+async def test_shown_before_confirmed():
+    hass, player, stats = await bridged_player()
+    signals = stats.signals
+
+    await pause(player)
+
+    assert player.PlaybackStatus == "Paused"
+    assert stats.signals == signals + 1
+    assert hass.perceived_latency.count == 1
+    assert hass.confirmation_latency.count == 0
+
+
+@pytest.mark.asyncio
+async def test_confirmed():
+    hass, player, stats = await bridged_player()
+    await pause(player)
+    signals = stats.signals
+
+    await hass.update_player(ENTITY, state("paused"))
+
+    assert player.PlaybackStatus == "Paused"
+    assert not player._expected
+    assert player._expiry is None
+    assert hass.confirmation_latency.count == 1
+    # nothing changed for the clients
+    assert stats.signals == signals
+
+
+@pytest.mark.asyncio
+async def test_conflicting_update():
+    hass, player, stats = await bridged_player()
+    await pause(player)
+
+    # an update sent before homeassistant handled the command
+    await hass.update_player(ENTITY, state("playing", volume_level=0.7))
+
+    # the expected state is kept on top of the other changes
+    assert player.PlaybackStatus == "Paused"
+    assert player.Volume == 0.7
+    assert "state" in player._expected
+    assert hass.confirmation_latency.count == 0
+
+
+@pytest.mark.asyncio
+async def test_expired():
+    hass, player, stats = await bridged_player(optimistic_timeout=0.01)
+    await pause(player)
+    signals = stats.signals
+
+    await asyncio.sleep(0.05)
+
+    assert player.PlaybackStatus == "Playing"
+    assert player.rollbacks == 1
+    assert not player._expected
+    assert stats.signals == signals + 1
+
+
+@pytest.mark.asyncio
+async def test_failed_command():
+    hass, player, stats = await bridged_player(fail=True)
+    signals = stats.signals
+
+    with pytest.raises(DBusError):
+        await pause(player)
+
+    assert player.PlaybackStatus == "Playing"
+    assert player.rollbacks == 1
+    assert not player._expected
+    assert player._expiry is None
+    # one for showing the expected state, one for rolling it back
+    assert stats.signals == signals + 2
+
+
+@pytest.mark.asyncio
+async def test_not_optimistic():
+    hass, player, stats = await bridged_player(optimistic=False)
+    signals = stats.signals
+
+    await pause(player)
+
+    assert player.PlaybackStatus == "Playing"
+    assert stats.signals == signals
+
+    await hass.update_player(ENTITY, state("paused"))
+
+    assert player.PlaybackStatus == "Paused"
+    # the perceived latency is the confirmation latency
+    assert hass.perceived_latency.count == 1
+    assert hass.confirmation_latency.count == 1
@@ -0,0 +1,121 @@
+"""Tests for the requests waiting for a response from homeassistant."""
+
+import asyncio
+
+import pytest
+from fakes import FakeWebsocket
+
+from hassbridge.hassinterface import HassError, HassInterface
+
+
+def connected_hass(**kwargs):
+    hass = HassInterface("http://localhost:8123", "token", **kwargs)
+    hass.ws = FakeWebsocket()
+    return hass
+
+
+def result(request_id, **response):
+    return {"id": request_id, "type": "result", **response}
+
+
+@pytest.mark.asyncio
+async def test_result():
+    hass = connected_hass()
+    future = await hass._make_request({"type": "ping"})
+
+    await hass._handle_decoded(result(1, success=True, result="pong"))
+
+    assert await future == "pong"
+    assert not hass._pending_requests
+
+
+@pytest.mark.asyncio
+async def test_error():
+    hass = connected_hass()
+    future = await hass._make_request({"type": "call_service"})
+
+    await hass._handle_decoded(result(1, success=False, error={"code": "x"}))
+
+    with pytest.raises(HassError):
+        await future
+
+
+@pytest.mark.asyncio
+async def test_timeout():
+    hass = connected_hass(request_timeout=0.01)
+    future = await hass._make_request({"type": "ping"})
+
+    with pytest.raises(asyncio.TimeoutError):
+        await future
+    assert hass.requests_timed_out == 1
+    assert not hass._pending_requests
+
+    # a late response is ignored
+    await hass._handle_decoded(result(1, success=True, result="pong"))
+
+
+@pytest.mark.asyncio
+async def test_timeout_per_request():
+    hass = connected_hass(request_timeout=0.01)
+    future = await hass._make_request({"type": "get_states"}, timeout=10)
+
+    await asyncio.sleep(0.05)
+
+    assert not future.done()
+
+
+@pytest.mark.asyncio
+async def test_eviction():
+    hass = connected_hass(max_pending_requests=2)
+    first = await hass._make_request({"type": "ping"})
+    second = await hass._make_request({"type": "ping"})
+    third = await hass._make_request({"type": "ping"})
+
+    with pytest.raises(HassError):
+        await first
+    assert not second.done()
+    assert not third.done()
+    assert hass.requests_evicted == 1
+    assert list(hass._pending_requests) == [2, 3]
+
+
+@pytest.mark.asyncio
+async def test_state_requests_are_not_evicted():
+    hass = connected_hass(max_pending_requests=2)
+    subscription = await hass._make_request({"type": "subscribe_events"})
+    states = await hass._make_request({"type": "get_states"})
+
+    # the limit is exceeded rather than losing the state
+    ping = await hass._make_request({"type": "ping"})
+    assert len(hass._pending_requests) == 3
+
+    # the oldest evictable one is evicted
+    await hass._make_request({"type": "ping"})
+    with pytest.raises(HassError):
+        await ping
+    assert not subscription.done()
+    assert not states.done()
+    assert list(hass._pending_requests) == [1, 2, 4]
+
+
+@pytest.mark.asyncio
+async def test_connection_lost():
+    hass = connected_hass()
+    hass._subscriptions[1] = object()
+    futures = [await hass._make_request({"type": "ping"}) for _ in range(3)]
+
+    hass._fail_pending_requests(ConnectionError("Connection lost"))
+
+    for future in futures:
+        with pytest.raises(ConnectionError):
+            await future
+    assert not hass._pending_requests
+    assert not hass._subscriptions
+
+
+@pytest.mark.asyncio
+async def test_not_connected():
+    hass = HassInterface("http://localhost:8123", "token")
+
+    with pytest.raises(ConnectionError):
+        await hass._make_request({"type": "ping"})
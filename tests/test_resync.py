@@ -0,0 +1,131 @@
+"""Tests for resyncing the players after reconnecting."""
+
+import asyncio
+import socket
+
+import pytest
+from fakes import FakeWebsocket, fake_bus_pool
+
+from hassbridge.hassinterface import HassInterface
+from hassbridge.simulator import Simulator
+
+KITCHEN = "media_player.kitchen"
+OFFICE = "media_player.office"
+
+
+def state(entity_id, updated="2024-01-01T00:00:00+00:00", volume=0.5):
+    return {
+        "entity_id": entity_id,
+        "state": "playing",
+        "attributes": {"volume_level": volume, "media_title": "Track"},
+        "last_updated": updated,
+        "context": {"id": f"{entity_id}@{updated}"},
+    }
+
+
+async def synced_hass():
+    """Return the hass interface with two players, disconnected, and the bus stats."""
+    bus_pool, stats = fake_bus_pool()
+    hass = HassInterface("http://localhost:8123", "token", bus_pool=bus_pool)
+    hass.ws = FakeWebsocket()
+    await hass.handle_get_states_result([state(KITCHEN), state(OFFICE)])
+    await hass.wait_for_players()
+
+    # like the connection loop does when the connection is lost
+    for player in hass._players.values():
+        player.stale = True
+
+    return hass, stats
+
+
+@pytest.mark.asyncio
+async def test_unchanged_players_are_skipped():
+    hass, stats = await synced_hass()
+    players = dict(hass._players)
+    signals = stats.signals
+
+    await hass.handle_get_states_result([state(KITCHEN), state(OFFICE)])
+
+    assert hass.resync_skipped == 2
+    assert hass._players == players
+    assert not any(player.stale for player in hass._players.values())
+    assert stats.signals == signals
+
+
+@pytest.mark.asyncio
+async def test_changed_players_are_updated():
+    hass, stats = await synced_hass()
+    signals = stats.signals
+
+    changed = state(KITCHEN, updated="2024-01-01T00:01:00+00:00", volume=0.7)
+    await hass.handle_get_states_result([changed, state(OFFICE)])
+
+    assert hass.resync_skipped == 1
+    assert hass._players[KITCHEN].Volume == 0.7
+    assert not hass._players[KITCHEN].stale
+    assert stats.signals == signals + 1
+
+
+@pytest.mark.asyncio
+async def test_vanished_players_are_removed():
+    hass, stats = await synced_hass()
+    assert stats.names == 2
+
+    await hass.handle_get_states_result([state(KITCHEN)])
+
+    assert list(hass._players) == [KITCHEN]
+    assert hass.players_removed == 1
+    # the name is released, and the connection returned to the pool
+    assert stats.names == 1
+    assert hass._bus_pool.open_connections == 2
+    assert len(hass._bus_pool._in_use) == 1
+
+
+@pytest.mark.asyncio
+async def test_vanished_players_are_kept():
+    hass, stats = await synced_hass()
+    hass._remove_deleted = False
+
+    await hass.handle_get_states_result([state(KITCHEN)])
+
+    assert sorted(hass._players) == [KITCHEN, OFFICE]
+    assert stats.names == 2
+
+
+async def wait_for(condition, timeout=5):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_exports_are_kept_over_reconnects():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    simulator = Simulator(players=3, entities=10, rate=0, seed=0)
+    server = asyncio.ensure_future(simulator.serve("127.0.0.1", port))
+    bus_pool, stats = fake_bus_pool()
+    hass = HassInterface(f"http://127.0.0.1:{port}", "token", bus_pool=bus_pool)
+    bridge = asyncio.ensure_future(hass.start())
+    try:
+        await wait_for(lambda: len(hass._players) == 3)
+        await hass.wait_for_players()
+        players = dict(hass._players)
+        reconnects = hass.reconnects
+
+        for conn in list(simulator._connections):
+            simulator._disconnect(conn.ws)
+        await wait_for(lambda: hass.resync_skipped == 3)
+    finally:
+        for task in (bridge, server):
+            task.cancel()
+        await asyncio.gather(bridge, server, return_exceptions=True)
+
+    assert hass.reconnects == reconnects + 1
+    # the players stayed exported, without new connections or names
+    assert hass._players == players
+    assert bus_pool.connections_opened == 3
+    assert stats.names == 3
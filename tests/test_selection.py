@@ -0,0 +1,123 @@
+"""Tests for the entity selection rules."""
+
+from hassbridge.selection import EntitySelector
+
+ENTITIES = [
+    {"entity_id": "media_player.kitchen", "area_id": "kitchen"},
+    {"entity_id": "media_player.living_room_tv", "device_id": "tv"},
+    {"entity_id": "media_player.office", "area_id": None},
+    {"entity_id": "sensor.kitchen_power", "area_id": "kitchen"},
+]
+DEVICES = [{"id": "tv", "area_id": "living_room"}]
+AREAS = [
+    {"area_id": "kitchen", "name": "Kitchen"},
+    {"area_id": "living_room", "name": "Living Room"},
+]
+
+
+def state(**attributes):
+    return {"state": "playing", "attributes": attributes}
+
+
+def test_defaults():
+    selector = EntitySelector()
+
+    assert selector.matches("media_player.kitchen", state())
+    assert not selector.matches("sensor.kitchen_power", state())
+    assert not selector.filters_ids
+    assert not selector.uses_areas
+
+
+def test_include_and_exclude():
+    selector = EntitySelector(
+        include=["media_player.living_*", "media_player.kitchen"],
+        exclude=["*_tv"],
+    )
+
+    assert selector.matches_id("media_player.kitchen")
+    assert selector.matches_id("media_player.living_room_speaker")
+    assert not selector.matches_id("media_player.living_room_tv")
+    assert not selector.matches_id("media_player.office")
+
+
+def test_areas_by_id_and_name():
+    selector = EntitySelector(areas=["kitchen", "Living Room"])
+    assert selector.uses_areas
+    # nothing matches before the registries are loaded
+    assert not selector.matches_id("media_player.kitchen")
+
+    selector.update_registry(ENTITIES, DEVICES, AREAS)
+
+    assert selector.matches_id("media_player.kitchen")
+    # the area of the device is used for entities without one
+    assert selector.matches_id("media_player.living_room_tv")
+    assert not selector.matches_id("media_player.office")
+    assert not selector.matches_id("sensor.kitchen_power")
+
+
+def test_state_rules():
+    selector = EntitySelector(
+        device_classes=["speaker"], attributes=["group_members", "source!=TV"]
+    )
+
+    assert selector.matches(
+        "media_player.kitchen",
+        state(device_class="speaker", group_members=[], source="Radio"),
+    )
+    assert not selector.matches(
+        "media_player.kitchen", state(device_class="tv", group_members=[])
+    )
+    assert not selector.matches(
+        "media_player.kitchen", state(device_class="speaker", source="Radio")
+    )
+    assert not selector.matches(
+        "media_player.kitchen",
+        state(device_class="speaker", group_members=[], source="TV"),
+    )
+
+
+def test_attribute_equals():
+    selector = EntitySelector(attributes=["app_name=Spotify"])
+
+    assert selector.matches("media_player.kitchen", state(app_name="Spotify"))
+    assert not selector.matches("media_player.kitchen", state(app_name="Plex"))
+    assert not selector.matches("media_player.kitchen", state())
+
+
+def test_subscription_filter():
+    selector = EntitySelector(exclude=["*.office"])
+    # the registry is needed to know the entity ids
+    assert selector.subscription_filter() is None
+
+    selector.update_registry(ENTITIES)
+
+    assert selector.subscription_filter() == [
+        "media_player.kitchen",
+        "media_player.living_room_tv",
+    ]
+
+
+def test_subscription_filter_without_id_rules():
+    selector = EntitySelector(device_classes=["speaker"])
+    selector.update_registry(ENTITIES)
+
+    assert selector.subscription_filter() is None
+
+
+def test_subscription_filter_without_matches():
+    selector = EntitySelector(include=["media_player.garage"])
+    selector.update_registry(ENTITIES)
+
+    # subscribe to all rather than to nothing
+    assert selector.subscription_filter() is None
+
+
+def test_update_registry_resets_index():
+    selector = EntitySelector(areas=["kitchen"])
+    selector.update_registry(ENTITIES, DEVICES, AREAS)
+    assert not selector.matches_id("media_player.office")
+
+    moved = [{"entity_id": "media_player.office", "area_id": "kitchen"}]
+    selector.update_registry(moved, DEVICES, AREAS)
+
+    assert selector.matches_id("media_player.office")
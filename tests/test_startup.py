@@ -0,0 +1,27 @@
+"""Tests for the cold start of the cli, see also benchmarks/startup.py."""
+
+import subprocess  # noqa: S404
+import sys
+
+from startup import CHECK_IMPORTS, time_command, time_help
+
+# maximum median time in ms taken by `hassbridge --help` over a bare interpreter,
+# generous as the test machines vary
+HELP_MARGIN_MS = 500
+
+
+def test_cli_import_is_lazy():
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", CHECK_IMPORTS],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.stdout.split() == []
+
+
+def test_help_within_budget():
+    interpreter = time_command(["-c", "pass"], runs=3)
+
+    assert time_help(runs=3) - interpreter <= HELP_MARGIN_MS
@@ -0,0 +1,104 @@
+"""Tests for discarding irrelevant frames before decoding them."""
+
+import json
+
+import pytest
+
+from hassbridge.hassinterface import HassInterface, _is_relevant_frame
+
+
+def dumps(obj) -> str:
+    """Serialize compactly, like homeassistant does."""
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def state_changed(entity_id) -> str:
+    state = {"entity_id": entity_id, "state": "on", "attributes": {}}
+    event = {
+        "event_type": "state_changed",
+        "data": {"entity_id": entity_id, "old_state": state, "new_state": state},
+    }
+    return dumps({"id": 1, "type": "event", "event": event})
+
+
+def entities_diff(entity_id) -> str:
+    event = {"c": {entity_id: {"+": {"s": "on"}}}}
+    return dumps({"id": 1, "type": "event", "event": event})
+
+
+RESULT = dumps({"id": 2, "type": "result", "success": True, "result": []})
+
+
+@pytest.mark.parametrize(
+    "frame",
+    [
+        state_changed("media_player.kitchen"),
+        entities_diff("media_player.kitchen"),
+        RESULT,
+        dumps({"type": "auth_ok", "ha_version": "2024.1.0"}),
+        dumps({"id": 3, "type": "pong"}),
+        # not serialized by homeassistant, so passed on to be safe
+        '{"event": {}, "type": "event", "id": 1}',
+        b"binary",
+    ],
+)
+def test_relevant(frame):
+    assert _is_relevant_frame(frame)
+
+
+@pytest.mark.parametrize(
+    "frame",
+    [state_changed("sensor.power"), entities_diff("light.kitchen")],
+)
+def test_irrelevant(frame):
+    assert not _is_relevant_frame(frame)
+
+
+@pytest.mark.asyncio
+async def test_handle_message_discards():
+    hass = HassInterface("http://localhost:8123", "token")
+
+    await hass.handle_message(state_changed("sensor.power"))
+
+    assert hass.frames_received == 1
+    assert hass.frames_discarded == 1
+
+
+def coalesced(*frames) -> str:
+    return "[" + ",".join(frames) + "]"
+
+
+@pytest.mark.parametrize(
+    "frame",
+    [
+        coalesced(state_changed("sensor.power"), state_changed("media_player.a")),
+        coalesced(state_changed("sensor.power"), RESULT),
+        coalesced(RESULT),
+    ],
+)
+def test_coalesced_relevant(frame):
+    assert _is_relevant_frame(frame)
+
+
+def test_coalesced_irrelevant():
+    frame = coalesced(state_changed("sensor.power"), entities_diff("light.kitchen"))
+
+    assert not _is_relevant_frame(frame)
+
+
+@pytest.mark.asyncio
+async def test_handle_message_coalesced():
+    hass = HassInterface("http://localhost:8123", "token")
+    handled = []
+
+    async def handle_event(msg):
+        handled.append(msg["event"]["data"]["entity_id"])
+
+    hass._subscriptions[1] = handle_event
+    await hass.handle_message(
+        coalesced(state_changed("sensor.power"), state_changed("media_player.a"))
+    )
+
+    assert hass.frames_discarded == 0
+    # the irrelevant events of relevant frames are decoded and handled as usual
+    assert handled == ["sensor.power", "media_player.a"]